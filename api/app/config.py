@@ -35,12 +35,46 @@ class Settings(BaseSettings):
     OPENSEARCH_USE_SSL: bool = False
     OPENSEARCH_VERIFY_CERTS: bool = False
     OPENSEARCH_INDEX: str = "documents"
+    # OPENSEARCH_INDEX is an alias over versioned indices (documents_v1, _v2...); shard/replica
+    # changes apply to the next version built by the reindex job
+    SEARCH_INDEX_SHARDS: int = 1
+    SEARCH_INDEX_REPLICAS: int = 0
+    SEARCH_REINDEX_SLICES: int = 4  # Parallel scroll slices when rebuilding
+    SEARCH_REINDEX_KEEP_OLD: bool = True  # Keep the previous version for rollback after the alias swap
+    CORRESPONDENCE_INDEX: str = "correspondence"  # Emails extracted from PSTs
+    OPENSEARCH_REFRESH: str = "none"  # none | wait_for | periodic (periodic refreshes are driven by the worker)
+    SEARCH_CACHE_ENABLED: bool = True  # Redis cache of first-page search results
+    SEARCH_CACHE_TTL: int = 300  # Seconds; entries are also invalidated whenever an index changes
+    SEARCH_CACHE_SETTLE_SECONDS: float = 6  # Don't cache results this soon after an index change (> refresh interval)
+    SEARCH_PIT_KEEP_ALIVE: str = "5m"  # How long a /search cursor stays valid between pages
+    SEARCH_CHUNK_CHARS: int = 2000  # Characters per nested text chunk
+    SEARCH_CHUNK_OVERLAP: int = 200  # Overlap so phrases spanning a boundary still match
+    SEARCH_MAX_CHUNKS: int = 5000  # Chunks grow beyond SEARCH_CHUNK_CHARS to stay under this (nested_objects.limit is 10000)
     
     # Other services
     REDIS_URL: str = "redis://redis:6379/0"
-    CELERY_QUEUE: str = "ocr"
+    CELERY_QUEUE: str = "ocr"  # Heavy OCR queue (scans, images, large files)
+    CELERY_FAST_QUEUE: str = "fast"  # Small text-bearing files, kept clear for interactive uploads
+    CELERY_PST_QUEUE: str = "pst"  # PST extraction
+    FAST_QUEUE_MAX_BYTES: int = 25 * 1024 * 1024  # Largest non-PDF sent to the fast queue
+    FAST_QUEUE_MAX_PDF_BYTES: int = 2 * 1024 * 1024  # PDFs above this are likely scans needing OCR
     TIKA_URL: str = "http://tika:9998"
     
+    # PST processing
+    PST_EVIDENCE_BATCH_SIZE: int = 2000  # Evidence rows per bulk INSERT
+    PST_INDEX_BULK_DOCS: int = 500  # Documents per OpenSearch _bulk request
+    PST_INDEX_BULK_BYTES: int = 10 * 1024 * 1024  # Max _bulk body size
+    PST_INDEX_MAX_RETRIES: int = 5  # Retries for items throttled with 429
+    PST_INDEX_INITIAL_BACKOFF: int = 2  # Seconds, doubles on each retry
+    ATTACHMENT_DEDUP_SCOPE: str = "company"  # company or case - where identical attachments are shared
+    PST_SCRATCH_DIR: str = ""  # Local (ideally NVMe) dir for downloaded PSTs; empty = system temp
+    PST_SCRATCH_SHARED: bool = False  # PST_SCRATCH_DIR is seen by every PST worker: partitions reuse the planning download
+    PST_DOWNLOAD_PART_SIZE: int = 64 * 1024 * 1024  # Bytes per ranged GET
+    PST_DOWNLOAD_CONCURRENCY: int = 16  # Parallel ranged GETs
+    PST_DOWNLOAD_VERIFY: bool = True  # Check the local copy against S3 ETag / x-amz-meta-sha256
+    PST_ATTACHMENT_STREAM_THRESHOLD: int = 16 * 1024 * 1024  # Larger attachments are streamed, not buffered
+    PST_ATTACHMENT_PART_SIZE: int = 16 * 1024 * 1024  # Read chunk / multipart part size (min 5 MiB)
+    
     # API settings
     API_HOST: str = "0.0.0.0"
     API_PORT: int = 8000
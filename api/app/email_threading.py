@@ -0,0 +1,299 @@
+"""
+Email threading engine
+
+Groups emails into threads in a single pass using union-find over:
+1. In-Reply-To / References headers (Message-ID links)
+2. Outlook Conversation-Index roots
+3. Normalised subject (fallback for emails with no usable headers)
+
+Rows are plain mappings with the keys:
+    id, message_id, in_reply_to, references, conversation_index,
+    subject, date, thread_id
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+# Leading reply/forward markers, e.g. "RE: FW: Re[2]: AW:"
+_SUBJECT_PREFIX_RE = re.compile(r'^\s*(?:(?:re|fw|fwd|aw|wg|sv|vs)\s*(?:\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# First 22 hex chars (11 bytes) of Conversation-Index identify the thread root
+CONVERSATION_ROOT_LENGTH = 22
+
+# Lookup key types, as persisted in email_thread_keys.key_type
+KEY_MESSAGE = 'message'
+KEY_CONVERSATION = 'conversation'
+KEY_SUBJECT = 'subject'
+
+
+def normalize_subject(subject: Optional[str]) -> str:
+    """Strip reply/forward prefixes and collapse whitespace for subject matching"""
+    if not subject:
+        return ''
+    stripped = _SUBJECT_PREFIX_RE.sub('', subject)
+    return _WHITESPACE_RE.sub(' ', stripped).strip().lower()
+
+
+def normalize_message_id(value: Optional[str]) -> Optional[str]:
+    """Drop angle brackets and surrounding whitespace from a Message-ID"""
+    if not value:
+        return None
+    value = value.strip().strip('<>').strip()
+    return value or None
+
+
+def parse_message_ids(value: Optional[str]) -> List[str]:
+    """Split an In-Reply-To / References value into individual Message-IDs"""
+    if not value:
+        return []
+    return value.replace('<', ' ').replace('>', ' ').split()
+
+
+def conversation_root(conversation_index: Optional[str]) -> Optional[str]:
+    """Return the thread-root prefix of a hex Conversation-Index"""
+    if not conversation_index or len(conversation_index) < CONVERSATION_ROOT_LENGTH:
+        return None
+    return conversation_index[:CONVERSATION_ROOT_LENGTH]
+
+
+def thread_id_for_message(message_id: str) -> str:
+    return f"thread_{hashlib.md5(message_id.encode()).hexdigest()[:12]}"
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, a: int, b: int) -> int:
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return ra
+        # Keep the lower index as root so results are deterministic
+        if rb < ra:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        return ra
+
+
+class EmailThreader:
+    """
+    Assigns thread IDs to emails in O(n) (amortised) time
+
+    The three lookup dicts map Message-ID, conversation root and normalised
+    subject to an already-known thread ID. They are filled from rows that
+    already carry a thread_id and extended with every new assignment, so one
+    threader can be fed several batches. Lookups may also be preloaded from
+    storage, in which case only new emails need to be passed to assign();
+    new_keys collects the lookups added since construction so they can be
+    persisted.
+    """
+
+    def __init__(
+        self,
+        message_threads: Optional[Dict[str, str]] = None,
+        conversation_threads: Optional[Dict[str, str]] = None,
+        subject_threads: Optional[Dict[str, str]] = None,
+    ):
+        self.message_threads = message_threads if message_threads is not None else {}
+        self.conversation_threads = conversation_threads if conversation_threads is not None else {}
+        self.subject_threads = subject_threads if subject_threads is not None else {}
+        self.new_keys: Dict[Tuple[str, str], str] = {}
+
+    def _lookup(self, key_type: str) -> Dict[str, str]:
+        return {
+            KEY_MESSAGE: self.message_threads,
+            KEY_CONVERSATION: self.conversation_threads,
+            KEY_SUBJECT: self.subject_threads,
+        }[key_type]
+
+    def _record(self, key_type: str, key: str, thread_id: str, overwrite: bool = False):
+        lookup = self._lookup(key_type)
+        if key in lookup and (not overwrite or lookup[key] == thread_id):
+            return
+        lookup[key] = thread_id
+        self.new_keys[(key_type, key)] = thread_id
+
+    def register(self, row: Mapping, thread_id: str):
+        """Record a row's identifiers as belonging to thread_id"""
+        message_id = normalize_message_id(row.get('message_id'))
+        if message_id:
+            self._record(KEY_MESSAGE, message_id, thread_id, overwrite=True)
+        # Parents seen only as references, so a later import of the parent
+        # itself joins this thread
+        for ref in parse_message_ids(row.get('in_reply_to')) + parse_message_ids(row.get('references')):
+            self._record(KEY_MESSAGE, ref, thread_id)
+        root = conversation_root(row.get('conversation_index'))
+        if root:
+            self._record(KEY_CONVERSATION, root, thread_id)
+        subject = normalize_subject(row.get('subject'))
+        if subject:
+            self._record(KEY_SUBJECT, subject, thread_id)
+
+    @staticmethod
+    def lookup_keys(rows: Iterable[Mapping]) -> Dict[str, Set[str]]:
+        """Keys whose stored threads are needed to thread the given rows"""
+        keys: Dict[str, Set[str]] = {KEY_MESSAGE: set(), KEY_CONVERSATION: set(), KEY_SUBJECT: set()}
+        for row in rows:
+            message_id = normalize_message_id(row.get('message_id'))
+            if message_id:
+                keys[KEY_MESSAGE].add(message_id)
+            keys[KEY_MESSAGE].update(parse_message_ids(row.get('in_reply_to')))
+            keys[KEY_MESSAGE].update(parse_message_ids(row.get('references')))
+            root = conversation_root(row.get('conversation_index'))
+            if root:
+                keys[KEY_CONVERSATION].add(root)
+            subject = normalize_subject(row.get('subject'))
+            if subject:
+                keys[KEY_SUBJECT].add(subject)
+        return keys
+
+    def load(self, key_type: str, key: str, thread_id: str):
+        """Seed a lookup from storage without marking it as new"""
+        self._lookup(key_type).setdefault(key, thread_id)
+
+    def assign(self, rows: Iterable[Mapping]) -> Dict:
+        """
+        Thread the given rows
+
+        Returns {row id: thread_id} for rows that did not already have a
+        thread. Rows that already have a thread_id keep it and only seed the
+        lookups.
+        """
+        pending: List[Mapping] = []
+        for row in rows:
+            if row.get('thread_id'):
+                self.register(row, row['thread_id'])
+            else:
+                pending.append(row)
+        if not pending:
+            return {}
+
+        uf = _UnionFind(len(pending))
+        message_ids = [normalize_message_id(r.get('message_id')) for r in pending]
+        conv_roots = [conversation_root(r.get('conversation_index')) for r in pending]
+        parents = [
+            parse_message_ids(r.get('in_reply_to')) + parse_message_ids(r.get('references'))
+            for r in pending
+        ]
+
+        # Union rows that share a Message-ID (same email in several folders/PSTs)
+        # or a conversation root
+        by_message: Dict[str, int] = {}
+        by_conversation: Dict[str, int] = {}
+        for i in range(len(pending)):
+            if message_ids[i]:
+                if message_ids[i] in by_message:
+                    uf.union(i, by_message[message_ids[i]])
+                else:
+                    by_message[message_ids[i]] = i
+            if conv_roots[i]:
+                if conv_roots[i] in by_conversation:
+                    uf.union(i, by_conversation[conv_roots[i]])
+                else:
+                    by_conversation[conv_roots[i]] = i
+
+        # Union replies with their parents, and with each other when the parent
+        # itself is missing from the batch (as register() would across imports)
+        linked = [bool(conv_roots[i]) for i in range(len(pending))]
+        by_reference: Dict[str, int] = {}
+        for i, refs in enumerate(parents):
+            for ref in refs:
+                target = by_message.get(ref)
+                if target is None:
+                    target = by_reference.setdefault(ref, i)
+                if target != i:
+                    uf.union(i, target)
+                    linked[i] = linked[target] = True
+
+        # Resolve components against already-known threads
+        existing: Dict[int, str] = {}
+        for i in range(len(pending)):
+            root = uf.find(i)
+            if root in existing:
+                continue
+            known = None
+            if message_ids[i]:
+                known = self.message_threads.get(message_ids[i])
+            if not known:
+                for ref in parents[i]:
+                    known = self.message_threads.get(ref)
+                    if known:
+                        break
+            if not known and conv_roots[i]:
+                known = self.conversation_threads.get(conv_roots[i])
+            if known:
+                existing[root] = known
+                linked[i] = True
+
+        # Subject fallback for emails no header could place
+        for i in range(len(pending)):
+            if linked[i] or uf.find(i) in existing:
+                continue
+            subject = normalize_subject(pending[i].get('subject'))
+            if not subject:
+                continue
+            known = self.subject_threads.get(subject)
+            if known:
+                existing[uf.find(i)] = known
+        subject_roots: Dict[str, int] = {}
+        for i in range(len(pending)):
+            subject = normalize_subject(pending[i].get('subject'))
+            if not subject or uf.find(i) in existing:
+                continue
+            if linked[i]:
+                subject_roots.setdefault(subject, uf.find(i))
+        for i in range(len(pending)):
+            if linked[i] or uf.find(i) in existing:
+                continue
+            subject = normalize_subject(pending[i].get('subject'))
+            if not subject:
+                continue
+            if subject in subject_roots:
+                uf.union(i, subject_roots[subject])
+            else:
+                subject_roots[subject] = uf.find(i)
+        existing = {uf.find(root): thread_id for root, thread_id in existing.items()}
+
+        # Name new threads after their earliest message
+        components: Dict[int, List[int]] = {}
+        for i in range(len(pending)):
+            components.setdefault(uf.find(i), []).append(i)
+
+        assignments = {}
+        for root, members in components.items():
+            thread_id = existing.get(root)
+            if not thread_id:
+                members.sort(key=lambda i: (_sort_key(pending[i].get('date')), i))
+                first_message = next((message_ids[i] for i in members if message_ids[i]), None)
+                first_conv = next((conv_roots[i] for i in members if conv_roots[i]), None)
+                if first_message:
+                    thread_id = thread_id_for_message(first_message)
+                elif first_conv:
+                    thread_id = f"thread_{first_conv}"
+                else:
+                    continue
+            for i in members:
+                assignments[pending[i]['id']] = thread_id
+                self.register(pending[i], thread_id)
+        return assignments
+
+
+def _sort_key(date) -> float:
+    if date is None:
+        return float('inf')
+    try:
+        return date.timestamp()
+    except (AttributeError, OverflowError, ValueError):
+        return float('inf')
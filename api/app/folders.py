@@ -173,7 +173,12 @@ def rename_folder_and_docs(db: Session, owner_user_id: str, old_path: str, new_n
 
 
 def delete_folder_and_docs(db: Session, owner_user_id: str, path: str, recursive: bool, delete_object_func, os_delete_func, logger) -> tuple:
-    """Delete a folder and optionally its contents"""
+    """
+    Delete a folder and optionally its contents
+
+    delete_object_func(doc) removes the document's stored object and returns
+    False when it was kept because other documents still share it.
+    """
     # Count documents at this path
     doc_count = db.query(Document).filter(
         Document.owner_user_id == owner_user_id,
@@ -203,8 +208,8 @@ def delete_folder_and_docs(db: Session, owner_user_id: str, path: str, recursive
         
         for doc in docs:
             try:
-                delete_object_func(doc.s3_key)
-                files_removed += 1
+                if delete_object_func(doc):
+                    files_removed += 1
             except Exception:
                 logger.exception("Failed to delete object %s", doc.s3_key)
             
@@ -224,8 +229,8 @@ def delete_folder_and_docs(db: Session, owner_user_id: str, path: str, recursive
         
         for doc in subdocs:
             try:
-                delete_object_func(doc.s3_key)
-                files_removed += 1
+                if delete_object_func(doc):
+                    files_removed += 1
             except Exception:
                 logger.exception("Failed to delete object %s", doc.s3_key)
             
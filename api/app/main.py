@@ -12,14 +12,15 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session, joinedload
 from .config import settings
 from .db import Base, engine
-from .models import Document, DocStatus, User, ShareLink, Folder
+from .models import Document, DocStatus, User, ShareLink, Folder, Case, CaseUser, AttachmentBlob
 from .storage import ensure_bucket, presign_put, presign_get, multipart_start, presign_part, multipart_complete, s3, get_object, put_object, delete_object
-from .search import ensure_index, search as os_search, delete_document as os_delete
-from .tasks import celery_app
+from . import search_cache
+from .search import ensure_index, search as os_search, search_all as os_search_all, delete_document as os_delete, hit_snippets, CursorError
+from .tasks import celery_app, extraction_queue
 from .security import get_db, current_user, hash_password, verify_password, sign_token
 from .watermark import build_watermarked_pdf, normalize_watermark_text
 from pydantic import BaseModel
-from .users import router as users_router
+from .users import router as users_router, require_admin
 from .sharing import router as sharing_router
 from .favorites import router as favorites_router
 from .versioning import router as versioning_router
@@ -230,21 +231,38 @@ def complete_upload(body: dict = Body(...), db: Session = Depends(get_db), user:
     )
     db.add(doc); db.commit(); 
     
-    # Check if PST file - trigger PST processor instead of OCR
+    # PST files go to the PST processor, everything else to OCR and AI classification
+    _queue_extraction(db, doc, body, user)
     if filename.lower().endswith('.pst'):
+        return {"id": str(doc.id), "status":"PROCESSING_PST", "message": "PST file queued for extraction"}
+    return {"id": str(doc.id), "status":"QUEUED", "ai_enabled": True}
+
+def _queue_extraction(db: Session, doc: Document, body: dict, user: User) -> str:
+    """Send the extraction task for a new document to the queue that suits its size and type"""
+    size = 0
+    if not doc.filename.lower().endswith('.pst'):
+        # Route on the stored object's size, never the one the client reported - an under-reported
+        # scan would otherwise land on the fast queue. Unknown (HEAD failed) routes as large.
+        try:
+            size = s3().head_object(Bucket=doc.bucket, Key=doc.s3_key)["ContentLength"]
+        except Exception:
+            logger.warning("Could not HEAD %s to route extraction", doc.s3_key, exc_info=True)
+        if size and size != doc.size:
+            doc.size = size; db.commit()
+    queue = extraction_queue(doc.filename, doc.content_type, size)
+    if doc.filename.lower().endswith('.pst'):
+        # PST files go to the PST processor instead of OCR
         # Get case_id and company_id from body or user
         case_id = body.get("case_id") or str(user.id)  # Default to user ID if no case
         company_id = body.get("company_id", "1")
-        
         celery_app.send_task(
             "worker_app.worker.process_pst_file", 
-            args=[str(doc.id), case_id, company_id]
+            args=[str(doc.id), case_id, company_id],
+            queue=queue
         )
-        return {"id": str(doc.id), "status":"PROCESSING_PST", "message": "PST file queued for extraction"}
     else:
-        # Queue OCR and AI classification for other files
-        celery_app.send_task("worker_app.worker.ocr_and_index", args=[str(doc.id)])
-        return {"id": str(doc.id), "status":"QUEUED", "ai_enabled": True}
+        celery_app.send_task("worker_app.worker.ocr_and_index", args=[str(doc.id)], queue=queue)
+    return queue
 
 @app.post("/uploads/multipart/start")
 def multipart_start_ep(body: dict = Body(...), user: User = Depends(current_user)):
@@ -273,7 +291,7 @@ def multipart_complete_ep(body: dict = Body(...), db: Session = Depends(get_db),
         status=DocStatus.NEW, 
         owner_user_id=user.id
     )
-    db.add(doc); db.commit(); celery_app.send_task("worker_app.worker.ocr_and_index", args=[str(doc.id)])
+    db.add(doc); db.commit(); _queue_extraction(db, doc, body, user)
     return {"id": str(doc.id), "status":"QUEUED"}
 
 
@@ -471,7 +489,7 @@ def delete_document_endpoint(doc_id: str, db: Session = Depends(get_db), user: U
     if not doc or doc.owner_user_id != user.id:
         raise HTTPException(404, "not found")
     try:
-        delete_object(doc.s3_key)
+        _delete_unshared_object(db, doc)
     except Exception:
         logger.exception("Failed to delete object %s from storage", doc.s3_key)
     try:
@@ -481,16 +499,82 @@ def delete_document_endpoint(doc_id: str, db: Session = Depends(get_db), user: U
     db.delete(doc)
     db.commit()
     return Response(status_code=204)
+def _delete_unshared_object(db: Session, doc: Document) -> bool:
+    """Delete a document's S3 object unless another document still points at it (deduplicated PST attachments)"""
+    db.flush()  # Documents already deleted in this session no longer count
+    # Lock the blob row so a PST import can't start reusing the key while we decide
+    db.query(AttachmentBlob.id).filter(AttachmentBlob.s3_key == doc.s3_key).with_for_update().all()
+    if db.query(Document.id).filter(Document.s3_key == doc.s3_key, Document.id != doc.id).first():
+        return False
+    delete_object(doc.s3_key)
+    return True
 # Search
 @app.get("/search")
-def search(q: str = Query(..., min_length=1), path_prefix: Optional[str] = None, user: User = Depends(current_user)):
-    res=os_search(q, size=25, path_prefix=path_prefix); hits=[]
+def search(q: str = Query(..., min_length=1), path_prefix: Optional[str] = None, size: int = Query(25, ge=1, le=100),
+           cursor: Optional[str] = None, content_type: Optional[str] = None, owner: Optional[str] = None,
+           uploaded_from: Optional[datetime] = None, uploaded_to: Optional[datetime] = None,
+           interval: str = Query("month", pattern="^(day|week|month|quarter|year)$"), user: User = Depends(current_user)):
+    try:
+        res=os_search(q, size=size, path_prefix=path_prefix, owner=owner, cursor=cursor, content_type=content_type,
+                      uploaded_from=uploaded_from.isoformat() if uploaded_from else None,
+                      uploaded_to=uploaded_to.isoformat() if uploaded_to else None, interval=interval); hits=[]
+    except CursorError as e:
+        raise HTTPException(400, str(e))
     for h in res.get("hits",{}).get("hits",[]):
-        src=h.get("_source",{})
+        src=h.get("_source",{}); fragments, pages = hit_snippets(h)
         hits.append({"id":src.get("id"),"filename":src.get("filename"),"title":src.get("title"),
                      "path":src.get("path"),"content_type":src.get("content_type"),"score":h.get("_score"),
-                     "snippet":" ... ".join(h.get("highlight",{}).get("text", src.get("text","")[:200:])) if h.get("highlight") else None})
-    return {"count": len(hits), "hits": hits}
+                     "snippet":" ... ".join(fragments) if fragments else None, "pages": pages})
+    # Not counted past the first page: None rather than a misleading 0
+    total=res.get("hits",{}).get("total")
+    facets={name: _facet(res, name) for name in ("content_type","path","owner","uploaded_at")} if "aggregations" in res else None
+    return {"count": len(hits), "total": total.get("value") if isinstance(total, dict) else total,
+            "hits": hits, "facets": facets, "next_cursor": res.get("next_cursor")}
+@app.get("/search/cache/stats")
+def search_cache_stats(user: User = Depends(current_user)):
+    """Hit/miss counters for the search result cache (all API processes)"""
+    return search_cache.stats()
+@app.post("/admin/search/reindex")
+def search_reindex(slices: Optional[int] = Query(None, ge=1, le=32), user: User = Depends(require_admin)):
+    """Rebuild the documents index into a new version in the background; searches keep working throughout"""
+    task = celery_app.send_task("worker_app.worker.reindex_documents", args=[slices], queue=settings.CELERY_QUEUE)
+    return {"task_id": task.id}
+def _user_case_ids(db: Session, user: User) -> List[str]:
+    """Cases whose correspondence the user may search"""
+    owned = db.query(Case.id).filter(Case.owner_id == user.id)
+    member = db.query(CaseUser.case_id).filter(CaseUser.user_id == user.id)
+    # PSTs uploaded without a case are filed under the uploader's user id
+    return [str(user.id)] + [str(row[0]) for row in owned.union(member).all()]
+def _facet(res: dict, name: str) -> List[dict]:
+    # Date histogram buckets are keyed by epoch millis; key_as_string is the ISO date
+    return [{"key": b.get("key_as_string", b["key"]), "count": b["doc_count"]} for b in res.get("aggregations",{}).get(name,{}).get("buckets",[])]
+@app.get("/search/all")
+def search_all(q: str = Query(..., min_length=1), case_id: Optional[str] = None, thread_id: Optional[str] = None,
+               path_prefix: Optional[str] = None, scope: str = Query("all", pattern="^(all|documents|correspondence)$"),
+               size: int = Query(25, ge=1, le=100), offset: int = Query(0, ge=0, le=9900),
+               db: Session = Depends(get_db), user: User = Depends(current_user)):
+    """Documents and PST emails in one ranked list, with source, case and thread facets"""
+    sources = ("documents","correspondence") if scope == "all" else (scope,)
+    case_ids = _user_case_ids(db, user)
+    if case_id and case_id not in case_ids:
+        raise HTTPException(404, "case not found")
+    res = os_search_all(q, case_ids, size=size, offset=offset, case_id=case_id, thread_id=thread_id,
+                        path_prefix=path_prefix, sources=sources)
+    hits = []
+    for h in res.get("hits",{}).get("hits",[]):
+        src = h.get("_source",{}); fragments, pages = hit_snippets(h)
+        snippet = " ... ".join(fragments) if fragments else None
+        if h.get("_index") == settings.CORRESPONDENCE_INDEX or src.get("type") == "email":
+            hits.append({"source":"email","id":src.get("id","").replace("evidence_","",1),"document_id":src.get("document_id"),
+                         "case_id":src.get("case_id"),"thread_id":src.get("thread_id"),"subject":src.get("subject"),
+                         "from":src.get("from"),"to":src.get("to"),"date":src.get("date"),"score":h.get("_score"),"snippet":snippet})
+        else:
+            hits.append({"source":"document","id":src.get("id"),"filename":src.get("filename"),"title":src.get("title"),
+                         "path":src.get("path"),"content_type":src.get("content_type"),"score":h.get("_score"),
+                         "snippet":snippet,"pages":pages})
+    total = res.get("hits",{}).get("total",{})
+    return {"total": total.get("value", 0) if isinstance(total, dict) else total, "offset": offset, "hits": hits,
+            "facets": {"sources": _facet(res,"sources"), "cases": _facet(res,"cases"), "threads": _facet(res,"threads")}}
 # Share links
 @app.post("/shares")
 def create_share(body: dict = Body(...), db: Session = Depends(get_db), user: User = Depends(current_user)):
@@ -609,7 +693,7 @@ def delete_folder(body: dict = Body(...), db: Session = Depends(get_db), user: U
     if not path: raise HTTPException(400, "path is required")
     path = validate_folder_path(path)
     try:
-        documents_deleted, files_removed = delete_folder_and_docs(db, user.id, path, recursive, delete_object, os_delete, logger)
+        documents_deleted, files_removed = delete_folder_and_docs(db, user.id, path, recursive, lambda doc: _delete_unshared_object(db, doc), os_delete, logger)
         db.commit()
         return {"deleted": True, "path": path, "documents_deleted": documents_deleted, "files_removed": files_removed}
     except Exception as e:
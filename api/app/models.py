@@ -1,5 +1,5 @@
 import uuid
-from sqlalchemy import Column, String, DateTime, Text, JSON, Enum, Integer, ForeignKey, Boolean
+from sqlalchemy import Column, String, DateTime, Text, JSON, Enum, Integer, BigInteger, ForeignKey, Boolean, UniqueConstraint
 from sqlalchemy.sql import func, expression
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
@@ -30,7 +30,7 @@ class Document(Base):
     content_type = Column(String(128), nullable=True)
     size = Column(Integer, nullable=True)
     bucket = Column(String(128), nullable=False)
-    s3_key = Column(String(2048), nullable=False)
+    s3_key = Column(String(2048), nullable=False, index=True)  # Shared by PST attachment documents with the same content
     status = Column(Enum(DocStatus), nullable=False, default=DocStatus.NEW)
     title = Column(String(512), nullable=True)
     meta = Column("metadata", JSON, nullable=True)
@@ -241,6 +241,39 @@ class Evidence(Base):
     document = relationship("Document")
     issue = relationship("Issue")
 
+class EmailThreadKey(Base):
+    """Persisted thread lookups (Message-ID, conversation root, subject) so new PSTs thread incrementally"""
+    __tablename__="email_thread_keys"
+    __table_args__ = (UniqueConstraint("case_id", "key_type", "key", name="uq_email_thread_keys_case_key"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    case_id = Column(UUID(as_uuid=True), ForeignKey("cases.id"), nullable=False)
+    key_type = Column(String(20), nullable=False)  # message, conversation, subject
+    key = Column(String(500), nullable=False)
+    thread_id = Column(String(100), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class AttachmentBlob(Base):
+    """Content-addressed email attachments - each SHA-256 is stored once in S3 per company (or case)"""
+    __tablename__="attachment_blobs"
+    __table_args__ = (UniqueConstraint("scope", "sha256", name="uq_attachment_blobs_scope_sha256"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    scope = Column(String(100), nullable=False)  # company:<id> or case:<id>
+    sha256 = Column(String(64), nullable=False)
+    # Document that first stored the content; other imports get their own Document on the same s3_key
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
+    s3_key = Column(String(2048), nullable=False, index=True)
+    size = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    document = relationship("Document")
+
+class ExtractionCache(Base):
+    """Extracted text keyed by SHA-256 of the file bytes, so repeat uploads skip Tika/OCR"""
+    __tablename__="extraction_cache"
+    sha256 = Column(String(64), primary_key=True)
+    text = Column(Text, nullable=False)
+    method = Column(String(20), nullable=True)  # tika, ocr
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class ClaimType(str, PyEnum):
     DELAY = "delay"
     DEFECT = "defect"
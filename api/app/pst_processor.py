@@ -19,16 +19,79 @@ from typing import Dict, List, Optional
 import tempfile
 import os
 import logging
+import uuid
 from io import BytesIO
 import re
 
+from opensearchpy.helpers import streaming_bulk
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from .models import Document, Evidence, DocStatus
-from .storage import s3
+from .models import Document, Evidence, DocStatus, EmailThreadKey, AttachmentBlob
+from .storage import s3, download_file_parallel
 from .config import settings
+from .email_threading import EmailThreader
+from .search_cache import bump_generation
 
 logger = logging.getLogger(__name__)
 
+CORRESPONDENCE_INDEX = settings.CORRESPONDENCE_INDEX
+
+_HEADER_LINE_RE = re.compile(r'^([!-9;-~]+):[ \t]*(.*)$')
+_ANGLE_ADDRESS_RE = re.compile(r'<\s*([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})\s*>')
+_EMAIL_RE = re.compile(r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})')
+
+
+def parse_transport_headers(raw: str) -> Dict[str, str]:
+    """
+    Parse RFC 5322 transport headers into {lowercased name: value}
+    
+    Folded continuation lines (starting with whitespace) are unfolded into
+    the previous header, so long References headers arrive whole. For a
+    repeated header the first occurrence is kept.
+    """
+    headers: Dict[str, str] = {}
+    name = None
+    parts: List[str] = []
+    
+    def commit():
+        if name is not None and name not in headers:
+            headers[name] = ' '.join(parts).strip()
+    
+    for line in raw.splitlines():
+        if not line.strip():
+            if name is not None:
+                # Blank line ends the header block
+                break
+            continue
+        if line[0] in ' \t':
+            if name is not None:
+                parts.append(line.strip())
+            continue
+        match = _HEADER_LINE_RE.match(line)
+        if not match:
+            continue
+        commit()
+        name = match.group(1).lower()
+        parts = [match.group(2).strip()]
+    commit()
+    return headers
+
+
+def _strip_angle_brackets(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return value
+    value = value.strip()
+    # Clean up angle brackets
+    if value.startswith('<') and value.endswith('>'):
+        value = value[1:-1]
+    return value
+
+
+# Namespace for deterministic Evidence IDs, so re-processing a PST reproduces
+# the same IDs and never inserts an email twice
+EVIDENCE_ID_NAMESPACE = uuid.UUID('6f1c2a8e-3b7d-4c55-9a0e-5d2f4b8c9e71')
+
 
 class UltimatePSTProcessor:
     """
@@ -42,14 +105,30 @@ class UltimatePSTProcessor:
     - Handles corrupted/password-protected PSTs
     """
     
-    def __init__(self, db: Session, s3_client, opensearch_client=None):
+    def __init__(self, db: Session, s3_client, opensearch_client=None, batch_size: Optional[int] = None):
         self.db = db
         self.s3 = s3_client
         self.opensearch = opensearch_client
         self.threads_map = {}
         self.processed_count = 0
         self.total_count = 0
-        self.attachment_hashes = {}  # For deduplication
+        self.attachment_hashes = {}  # sha256 -> attachment document ID created by this run
+        self._blob_keys: Dict[str, str] = {}  # sha256 -> S3 key of content already stored in the scope
+        self._blob_buffer: List[Dict] = []  # New attachment_blobs rows for the next batch
+        self._attachment_buffer: List[Dict] = []  # New attachment Document rows for the next batch
+        # Evidence rows are buffered and written with one executemany per batch
+        self.batch_size = batch_size or settings.PST_EVIDENCE_BATCH_SIZE
+        self._evidence_buffer: List[Dict] = []
+        # OpenSearch bulk actions waiting for the next _bulk request
+        self._index_buffer: List[Dict] = []
+        self._index_buffer_bytes = 0
+        # Checkpointing: messages are numbered in processing order; everything
+        # before _resume_from was committed by an earlier run and is skipped
+        self._checkpoint_document: Optional[Document] = None
+        self._checkpoint_key: Optional[str] = None
+        self._resume_from = 0
+        self._position = 0
+        self._current_message = ('', 0)
         
     def process_pst(self, pst_s3_key: str, document_id: int, case_id: int, company_id: int) -> Dict:
         """
@@ -59,51 +138,19 @@ class UltimatePSTProcessor:
         """
         logger.info(f"Starting PST processing for document_id={document_id}")
         
-        stats = {
-            'total_emails': 0,
-            'total_attachments': 0,
-            'unique_attachments': 0,  # After deduplication
-            'threads_identified': 0,
-            'size_saved': 0,  # Bytes saved by not storing email files
-            'processing_time': 0,
-            'errors': []
-        }
-        
+        stats = self._new_stats()
         start_time = datetime.utcnow()
 
         # Update document status
-        document = self.db.query(Document).filter_by(id=document_id).first()
-        if not document:
-            raise ValueError(f"Document {document_id} not found")
-
-        def set_processing_meta(status: str, **extra):
-            meta = dict(document.meta or {})
-            pst_meta = dict(meta.get('pst_processing') or {})
-            pst_meta.update(extra)
-            pst_meta['status'] = status
-            meta['pst_processing'] = pst_meta
-            document.meta = meta
-
+        document = self._get_document(document_id)
+        self._resume_from_checkpoint(document, pst_s3_key, stats)
         document.status = DocStatus.PROCESSING
-        set_processing_meta('processing', started_at=start_time.isoformat())
+        self._set_processing_meta(document, 'processing', started_at=start_time.isoformat())
         self.db.commit()
+        self._checkpoint_document = document
+        self._checkpoint_key = pst_s3_key
         
-        # Download PST from S3 to temp file
-        with tempfile.NamedTemporaryFile(suffix='.pst', delete=False) as tmp:
-            try:
-                logger.info(f"Downloading PST from s3://{settings.S3_BUCKET}/{pst_s3_key}")
-                self.s3.download_fileobj(
-                    Bucket=settings.S3_BUCKET,
-                    Key=pst_s3_key,
-                    Fileobj=tmp
-                )
-                pst_path = tmp.name
-            except Exception as e:
-                logger.error(f"Failed to download PST: {e}")
-                document.status = DocStatus.FAILED
-                set_processing_meta('failed', error=str(e), failed_at=datetime.utcnow().isoformat())
-                self.db.commit()
-                raise
+        pst_path = self._download_pst(pst_s3_key, document)
         
         try:
             # Open PST with pypff
@@ -117,19 +164,19 @@ class UltimatePSTProcessor:
             self.total_count = self._count_messages(root)
             logger.info(f"Found {self.total_count} total messages to process")
             
+            if self.opensearch:
+                self._ensure_correspondence_index()
+            
             # Process all folders recursively
             self._process_folder(root, document, case_id, company_id, stats)
             
+            # Write whatever is left in the last partial batch
+            self._flush_evidence(stats)
+            
             # Build thread relationships after all emails are extracted
             logger.info("Building email thread relationships...")
-            self._build_thread_relationships(case_id)
-            
-            # Count unique threads (threads_map values are dicts with thread_id)
-            unique_threads = set()
-            for thread_info in self.threads_map.values():
-                if isinstance(thread_info, dict) and 'thread_id' in thread_info:
-                    unique_threads.add(thread_info['thread_id'])
-            stats['threads_identified'] = len(unique_threads)
+            self._build_thread_relationships(case_id, document.id)
+            stats['threads_identified'] = self._count_threads(document.id)
             
             # Calculate stats
             stats['unique_attachments'] = len(self.attachment_hashes)
@@ -137,7 +184,8 @@ class UltimatePSTProcessor:
             
             # Update document with success status
             document.status = DocStatus.READY
-            set_processing_meta('completed', processed_at=datetime.utcnow().isoformat(), stats=stats)
+            self._set_processing_meta(document, 'completed', processed_at=datetime.utcnow().isoformat(), stats=stats,
+                                      checkpoint=None)
             self.db.commit()
             
             pst_file.close()
@@ -146,9 +194,7 @@ class UltimatePSTProcessor:
             
         except Exception as e:
             logger.error(f"PST processing failed: {e}", exc_info=True)
-            document.status = DocStatus.FAILED
-            set_processing_meta('failed', error=str(e), failed_at=datetime.utcnow().isoformat())
-            self.db.commit()
+            self._mark_failed(document, e)
             stats['errors'].append(str(e))
             raise
             
@@ -159,6 +205,268 @@ class UltimatePSTProcessor:
         
         return stats
     
+    # ------------------------------------------------------------------
+    # Parallel mode: plan -> process partitions (fan-out) -> finalize
+    # ------------------------------------------------------------------
+    
+    def plan_partitions(self, pst_s3_key: str, document_id, partitions: int, min_messages: int = 1) -> List[List[Dict]]:
+        """
+        Split the PST into roughly equal partitions of messages
+        
+        At most `partitions` partitions are made, each with at least
+        `min_messages` messages (except possibly the last).
+        
+        Each partition is a list of segments:
+            {'folder': [sub-folder indices from root], 'path': display path,
+             'start': first message index, 'end': message index (exclusive)}
+        Small folders are packed together; folders larger than one partition
+        are split into message-index ranges.
+        """
+        document = self._get_document(document_id)
+        document.status = DocStatus.PROCESSING
+        self._set_processing_meta(document, 'processing', started_at=datetime.utcnow().isoformat(), mode='parallel')
+        self.db.commit()
+        
+        # With shared scratch the planning copy is kept for the partitions (finalize_partitions removes it)
+        shared_path = self._shared_pst_path(document_id)
+        pst_path = self._download_pst(pst_s3_key, document, dest=shared_path)
+        try:
+            pst_file = pypff.file()
+            pst_file.open(pst_path)
+            try:
+                root = pst_file.get_root_folder()
+                self.total_count = self._count_messages(root)
+                target = max(1, min_messages, -(-self.total_count // max(1, partitions)))  # ceil division
+                
+                plan: List[List[Dict]] = []
+                current: List[Dict] = []
+                current_size = 0
+                for indices, path, count in self._walk_folders(root):
+                    start = 0
+                    while start < count:
+                        take = min(count - start, target - current_size)
+                        current.append({'folder': indices, 'path': path, 'start': start, 'end': start + take})
+                        current_size += take
+                        start += take
+                        if current_size >= target:
+                            plan.append(current)
+                            current, current_size = [], 0
+                if current:
+                    plan.append(current)
+            finally:
+                pst_file.close()
+        except Exception as e:
+            logger.error(f"PST partition planning failed: {e}", exc_info=True)
+            self._mark_failed(document, e)
+            shared_path = None
+            raise
+        finally:
+            if pst_path != shared_path and os.path.exists(pst_path):
+                os.unlink(pst_path)
+        
+        self._set_processing_meta(document, 'processing', total_messages=self.total_count, partitions=len(plan))
+        self.db.commit()
+        logger.info(f"Planned {len(plan)} partitions for {self.total_count} messages in document {document_id}")
+        return plan
+    
+    def process_partition(self, pst_s3_key: str, document_id, case_id, company_id, segments: List[Dict]) -> Dict:
+        """
+        Extract one partition of a PST (map step)
+        
+        Threading and the document status update are left to
+        finalize_partitions, which runs once every partition has finished.
+        """
+        stats = self._new_stats()
+        start_time = datetime.utcnow()
+        document = self._get_document(document_id)
+        self.total_count = sum(seg['end'] - seg['start'] for seg in segments)
+        
+        pst_path = self._shared_pst_path(document_id)
+        owned = False
+        try:
+            # Download failures are reported like any other so finalize_pst still runs
+            if not pst_path or not os.path.exists(pst_path):
+                pst_path = self._download_pst(pst_s3_key)
+                owned = True
+            pst_file = pypff.file()
+            pst_file.open(pst_path)
+            try:
+                root = pst_file.get_root_folder()
+                if self.opensearch:
+                    self._ensure_correspondence_index()
+                
+                for seg in segments:
+                    folder = root
+                    for i in seg['folder']:
+                        folder = folder.get_sub_folder(i)
+                    logger.info(f"Processing {seg['path']} messages {seg['start']}-{seg['end']}")
+                    self._process_messages(folder, seg['start'], seg['end'], document, case_id, company_id, stats,
+                                           seg['path'], seg['folder'])
+                
+                self._flush_evidence(stats)
+            finally:
+                pst_file.close()
+        except Exception as e:
+            logger.error(f"PST partition failed: {e}", exc_info=True)
+            self.db.rollback()
+            stats['errors'].append(str(e))
+            stats['failed'] = True
+        finally:
+            if owned and os.path.exists(pst_path):
+                os.unlink(pst_path)
+        
+        stats['unique_attachments'] = len(self.attachment_hashes)
+        stats['processing_time'] = (datetime.utcnow() - start_time).total_seconds()
+        return stats
+    
+    def finalize_partitions(self, document_id, case_id, partial_stats: List[Dict]) -> Dict:
+        """Merge partition stats, build threads and mark the document done (reduce step)"""
+        document = self._get_document(document_id)
+        shared_path = self._shared_pst_path(document_id)
+        if shared_path and os.path.exists(shared_path):
+            os.unlink(shared_path)
+        stats = self._new_stats()
+        failed = False
+        for partial in partial_stats:
+            for key in ('total_emails', 'total_attachments', 'size_saved'):
+                stats[key] += partial.get(key, 0)
+            # Partitions run side by side - wall time is the slowest one
+            stats['processing_time'] = max(stats['processing_time'], partial.get('processing_time', 0))
+            stats['errors'].extend(partial.get('errors', []))
+            failed = failed or partial.get('failed', False)
+        
+        try:
+            logger.info("Building email thread relationships...")
+            self._build_thread_relationships(case_id, document.id)
+            stats['threads_identified'] = self._count_threads(document.id)
+            # Partitions only dedupe their own attachments, so their counts can't be summed
+            stats['unique_attachments'] = self._count_unique_attachments(document.id)
+        except Exception as e:
+            logger.error(f"PST thread building failed: {e}", exc_info=True)
+            self._mark_failed(document, e)
+            raise
+        
+        if failed:
+            document.status = DocStatus.FAILED
+            self._set_processing_meta(document, 'failed', failed_at=datetime.utcnow().isoformat(), stats=stats,
+                                      error='One or more partitions failed')
+        else:
+            document.status = DocStatus.READY
+            self._set_processing_meta(document, 'completed', processed_at=datetime.utcnow().isoformat(), stats=stats)
+        self.db.commit()
+        logger.info(f"PST processing completed: {stats}")
+        return stats
+    
+    # ------------------------------------------------------------------
+    
+    @staticmethod
+    def _new_stats() -> Dict:
+        return {
+            'total_emails': 0,
+            'total_attachments': 0,
+            'unique_attachments': 0,  # After deduplication
+            'threads_identified': 0,
+            'size_saved': 0,  # Bytes saved by not storing email files
+            'processing_time': 0,
+            'errors': []
+        }
+    
+    def _get_document(self, document_id) -> Document:
+        document = self.db.query(Document).filter_by(id=document_id).first()
+        if not document:
+            raise ValueError(f"Document {document_id} not found")
+        return document
+    
+    @staticmethod
+    def _set_processing_meta(document: Document, status: str, **extra):
+        meta = dict(document.meta or {})
+        pst_meta = dict(meta.get('pst_processing') or {})
+        pst_meta.update(extra)
+        pst_meta['status'] = status
+        meta['pst_processing'] = pst_meta
+        document.meta = meta
+    
+    def _mark_failed(self, document: Document, error: Exception):
+        # Drop the uncommitted batch - a re-run resumes from the last checkpoint
+        self.db.rollback()
+        document.status = DocStatus.FAILED
+        self._set_processing_meta(document, 'failed', error=str(error), failed_at=datetime.utcnow().isoformat())
+        self.db.commit()
+    
+    @staticmethod
+    def _shared_pst_path(document_id) -> Optional[str]:
+        """Where the planning copy of a partitioned PST lives, if scratch is shared between workers"""
+        if not (settings.PST_SCRATCH_SHARED and settings.PST_SCRATCH_DIR):
+            return None
+        return os.path.join(settings.PST_SCRATCH_DIR, f"pst-{document_id}.pst")
+    
+    def _download_pst(self, pst_s3_key: str, document: Optional[Document] = None, dest: Optional[str] = None) -> str:
+        """
+        Download PST from S3 into the scratch dir with parallel ranged GETs; the caller removes it
+        
+        With dest, the file is downloaded next to it and renamed into place
+        once complete, so readers never see a partial copy.
+        """
+        scratch_dir = settings.PST_SCRATCH_DIR or None
+        if scratch_dir:
+            os.makedirs(scratch_dir, exist_ok=True)
+        fd, pst_path = tempfile.mkstemp(suffix='.pst', dir=os.path.dirname(dest) if dest else scratch_dir)
+        os.close(fd)
+        try:
+            logger.info(f"Downloading PST from s3://{settings.S3_BUCKET}/{pst_s3_key} to {pst_path}")
+            started = datetime.utcnow()
+            size = download_file_parallel(
+                self.s3,
+                settings.S3_BUCKET,
+                pst_s3_key,
+                pst_path,
+                part_size=settings.PST_DOWNLOAD_PART_SIZE,
+                concurrency=settings.PST_DOWNLOAD_CONCURRENCY,
+                verify=settings.PST_DOWNLOAD_VERIFY
+            )
+            elapsed = max((datetime.utcnow() - started).total_seconds(), 0.001)
+            logger.info(f"Downloaded {size} bytes in {elapsed:.1f}s ({size / elapsed / 1024 / 1024:.1f} MiB/s)")
+            if dest:
+                os.replace(pst_path, dest)
+                return dest
+            return pst_path
+        except Exception as e:
+            logger.error(f"Failed to download PST: {e}")
+            os.unlink(pst_path)
+            if document is not None:
+                self._mark_failed(document, e)
+            raise
+    
+    def _resume_from_checkpoint(self, document: Document, pst_s3_key: str, stats: Dict):
+        """Pick up after the last committed batch of an interrupted run"""
+        pst_meta = (document.meta or {}).get('pst_processing') or {}
+        checkpoint = pst_meta.get('checkpoint')
+        if not checkpoint or checkpoint.get('s3_key') != pst_s3_key:
+            return
+        self._resume_from = checkpoint.get('messages_committed', 0)
+        for key, value in (checkpoint.get('stats') or {}).items():
+            stats[key] = value
+        logger.info(
+            f"Resuming PST {document.id} after {self._resume_from} committed messages "
+            f"(last: {checkpoint.get('folder_path')} #{checkpoint.get('message_index')})"
+        )
+    
+    def _count_threads(self, document_id) -> int:
+        return (
+            self.db.query(Evidence.thread_id)
+            .filter(Evidence.document_id == document_id, Evidence.thread_id.isnot(None))
+            .distinct()
+            .count()
+        )
+    
+    def _count_unique_attachments(self, document_id) -> int:
+        return (
+            self.db.query(Document.meta['file_hash'].as_string())
+            .filter(Document.meta['parent_document_id'].as_string() == str(document_id))
+            .distinct()
+            .count()
+        )
+    
     def _count_messages(self, folder) -> int:
         """Recursively count total messages for progress tracking"""
         count = folder.number_of_sub_messages
@@ -167,7 +475,15 @@ class UltimatePSTProcessor:
             count += self._count_messages(subfolder)
         return count
     
-    def _process_folder(self, folder, document, case_id, company_id, stats, folder_path=''):
+    def _walk_folders(self, folder, indices=(), folder_path=''):
+        """Yield (sub-folder indices, display path, message count) in processing order"""
+        folder_name = folder.name or 'Root'
+        current_path = f"{folder_path}/{folder_name}" if folder_path else folder_name
+        yield list(indices), current_path, folder.number_of_sub_messages
+        for i in range(folder.number_of_sub_folders):
+            yield from self._walk_folders(folder.get_sub_folder(i), indices + (i,), current_path)
+    
+    def _process_folder(self, folder, document, case_id, company_id, stats, folder_path='', folder_indices=()):
         """
         Recursively process PST folders
         """
@@ -177,10 +493,33 @@ class UltimatePSTProcessor:
         logger.info(f"Processing folder: {current_path} ({folder.number_of_sub_messages} messages)")
         
         # Process messages in this folder
-        for i in range(folder.number_of_sub_messages):
+        self._process_messages(folder, 0, folder.number_of_sub_messages, document, case_id, company_id, stats,
+                               current_path, folder_indices)
+        
+        # Process subfolders
+        for i in range(folder.number_of_sub_folders):
+            try:
+                subfolder = folder.get_sub_folder(i)
+                self._process_folder(subfolder, document, case_id, company_id, stats, current_path, folder_indices + (i,))
+            except Exception as e:
+                logger.error(f"Error processing subfolder {i} in {current_path}: {e}")
+                stats['errors'].append(f"Subfolder {i} in {current_path}: {str(e)}")
+    
+    def _process_messages(self, folder, start, end, document, case_id, company_id, stats, current_path, folder_indices):
+        """Process messages [start, end) of a single folder"""
+        # Skip messages already committed by an interrupted run
+        skip = min(end - start, max(0, self._resume_from - self._position))
+        self._position += skip
+        start += skip
+        
+        folder_key = '/'.join(str(i) for i in folder_indices)
+        for i in range(start, end):
+            self._position += 1
+            self._current_message = (current_path, i)
             try:
                 message = folder.get_sub_message(i)
-                self._process_message(message, document, case_id, company_id, stats, current_path)
+                self._process_message(message, document, case_id, company_id, stats, current_path,
+                                      f"{folder_key}:{i}")
                 stats['total_emails'] += 1
                 self.processed_count += 1
                 
@@ -192,15 +531,10 @@ class UltimatePSTProcessor:
             except Exception as e:
                 logger.error(f"Error processing message {i} in {current_path}: {e}")
                 stats['errors'].append(f"Message {i} in {current_path}: {str(e)}")
-        
-        # Process subfolders
-        for i in range(folder.number_of_sub_folders):
-            try:
-                subfolder = folder.get_sub_folder(i)
-                self._process_folder(subfolder, document, case_id, company_id, stats, current_path)
-            except Exception as e:
-                logger.error(f"Error processing subfolder {i} in {current_path}: {e}")
-                stats['errors'].append(f"Subfolder {i} in {current_path}: {str(e)}")
+            
+            # Commit on message boundaries so the checkpoint is exact
+            if len(self._evidence_buffer) >= self.batch_size:
+                self._flush_evidence(stats)
     
     def _safe_get_attr(self, obj, attr_name, default=None):
         """Safely get attribute from pypff object"""
@@ -209,52 +543,53 @@ class UltimatePSTProcessor:
         except:
             return default
     
-    def _extract_email_from_headers(self, message):
-        """Extract email address from transport headers (RFC 2822 format)"""
+    def _parse_headers(self, message) -> Dict[str, str]:
+        """Tokenise the message's transport headers once (see parse_transport_headers)"""
+        transport_headers = self._safe_get_attr(message, 'transport_headers', None)
+        if not transport_headers:
+            return {}
         try:
-            transport_headers = self._safe_get_attr(message, 'transport_headers', None)
-            if not transport_headers:
-                return None
-            
-            # Look for From: header line
-            import re
-            from_pattern = r'^From:\s*(?:.*?<)?([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})>?'
-            
-            for line in str(transport_headers).split('\n'):
-                match = re.match(from_pattern, line, re.IGNORECASE)
-                if match:
-                    return match.group(1)
-            
-            # Alternative: look for any email in transport headers
-            email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-            matches = re.findall(email_pattern, str(transport_headers))
-            if matches:
-                return matches[0]
-                
+            return parse_transport_headers(str(transport_headers))
         except Exception as e:
-            logger.debug(f"Could not extract email from headers: {e}")
-        
-        return None
+            logger.debug(f"Could not parse transport headers: {e}")
+            return {}
+    
+    @staticmethod
+    def _extract_email_from_headers(headers: Dict[str, str]) -> Optional[str]:
+        """
+        Extract sender address from the parsed From: header
+        pypff doesn't expose direct .sender_email_address - parse from headers
+        """
+        from_value = headers.get('from')
+        if not from_value:
+            return None
+        # Format is "Name <email@domain.com>" or just "email@domain.com"
+        match = _ANGLE_ADDRESS_RE.search(from_value) or _EMAIL_RE.search(from_value)
+        return match.group(1) if match else None
     
-    def _process_message(self, message, document, case_id, company_id, stats, folder_path):
+    def _process_message(self, message, document, case_id, company_id, stats, folder_path, message_key):
         """
         Process individual email message
         
+        message_key ("<sub-folder indices>:<message index>") identifies the
+        message within the PST and seeds its deterministic Evidence ID.
+        
         KEY INSIGHT: We DON'T save the email as a file - we extract and index content directly!
         This saves ~90% storage compared to traditional PST extraction
         """
         
-        # Extract email headers
-        message_id = self._get_header(message, 'Message-ID')
-        in_reply_to = self._get_header(message, 'In-Reply-To')
-        references = self._get_header(message, 'References')
+        # Extract email headers (tokenised once per message)
+        headers = self._parse_headers(message)
+        message_id = _strip_angle_brackets(headers.get('message-id'))
+        in_reply_to = _strip_angle_brackets(headers.get('in-reply-to'))
+        references = headers.get('references')
         
         # Safely get attributes - pypff objects have limited attributes
         subject = self._safe_get_attr(message, 'subject', '')
         sender_name = self._safe_get_attr(message, 'sender_name', '')
         
         # Extract email address from transport headers
-        from_email = self._extract_email_from_headers(message)
+        from_email = self._extract_email_from_headers(headers)
         if not from_email:
             from_email = sender_name  # Fallback to sender name if no email found
         
@@ -279,7 +614,7 @@ class UltimatePSTProcessor:
         except:
             pass
         
-        thread_topic = self._get_header(message, 'Thread-Topic') or subject
+        thread_topic = headers.get('thread-topic') or subject
         
         # Extract email data
         email_data = {
@@ -326,30 +661,38 @@ class UltimatePSTProcessor:
         email_size = len(content) + len(str(email_data))
         stats['size_saved'] += email_size
         
+        # The UUID is generated client-side so the row can be buffered and
+        # bulk-inserted later while threading and indexing still get its ID now.
+        # It is derived from the message's position so a re-run (resumed or
+        # redelivered) produces the same IDs and skips rows already written.
+        evidence_id = uuid.uuid5(EVIDENCE_ID_NAMESPACE, f"{document.id}:{message_key}")
+        
         # Process attachments (THESE we DO save!)
         attachments_info = []
         if message.number_of_attachments > 0:
             attachments_info = self._process_attachments(
-                message, document, case_id, company_id, stats
+                message, document, case_id, company_id, stats, evidence_id
             )
         
-        # Create Evidence record (links email to case/documents)
+        # Build Evidence row (links email to case/documents)
         # NOTE: Evidence model doesn't have a content column - it uses metadata field
-        evidence = Evidence(
-            document_id=document.id,  # Parent PST document
-            case_id=case_id,
-            date_of_evidence=email_data['date'],
-            email_from=email_data['from'],
-            email_to=email_data['to'],
-            email_cc=email_data['cc'],
-            email_subject=email_data['subject'],
-            email_date=email_data['date'],
-            email_message_id=message_id,
-            email_in_reply_to=in_reply_to,
-            email_thread_topic=thread_topic,
-            email_conversation_index=conversation_index,
+        evidence_row = {
+            'id': evidence_id,
+            'document_id': document.id,  # Parent PST document
+            'case_id': case_id,
+            'date_of_evidence': email_data['date'],
+            'email_from': email_data['from'],
+            'email_to': email_data['to'],
+            'email_cc': email_data['cc'],
+            'email_subject': email_data['subject'],
+            'email_date': email_data['date'],
+            'email_message_id': message_id,
+            'email_in_reply_to': in_reply_to,
+            'email_thread_topic': thread_topic,
+            'email_conversation_index': conversation_index,
+            'thread_id': None,
             # Store content in meta field (maps to metadata column)
-            meta={
+            'meta': {
                 'content': content,
                 'content_type': content_type,
                 'attachments': attachments_info,
@@ -358,35 +701,84 @@ class UltimatePSTProcessor:
                 'importance': email_data['importance'],
                 'has_attachments': email_data['has_attachments']
             }
-        )
-        self.db.add(evidence)
-        self.db.flush()  # Get evidence ID immediately
+        }
+        self._evidence_buffer.append(evidence_row)
         
         # Index to OpenSearch if available
         if self.opensearch:
             try:
-                self._index_to_opensearch(evidence, email_data, content)
+                self._index_to_opensearch(evidence_row, email_data, content, stats)
             except Exception as e:
-                logger.warning(f"OpenSearch indexing failed for evidence {evidence.id}: {e}")
+                logger.warning(f"OpenSearch indexing failed for evidence {evidence_id}: {e}")
         
         # Track for threading
         if message_id:
             self.threads_map[message_id] = {
-                'evidence_id': str(evidence.id),
+                'evidence_id': str(evidence_id),
                 'in_reply_to': in_reply_to,
                 'references': references,
                 'date': email_data['date'],
                 'subject': email_data['subject']
             }
     
-    def _process_attachments(self, message, document, case_id, company_id, stats) -> List[Dict]:
+    def _flush_evidence(self, stats: Dict):
+        """
+        Write buffered Evidence rows in a single executemany INSERT and commit
+        
+        Attachment Documents and blobs are written the same way, so one
+        batch costs a handful of statements instead of one INSERT per email.
+        Rows whose ID already exists (written by an earlier, interrupted or
+        redelivered run) are skipped. Each commit also records a
+        checkpoint so a re-run can resume after this batch.
+        """
+        rows = self._evidence_buffer
+        self._evidence_buffer = []
+        self.db.flush()
+        if self._attachment_buffer:
+            self.db.execute(pg_insert(Document).on_conflict_do_nothing(index_elements=['id']), self._attachment_buffer)
+            self._attachment_buffer = []
+        if self._blob_buffer:
+            # A concurrent import may have stored the same content first
+            self.db.execute(
+                pg_insert(AttachmentBlob).on_conflict_do_nothing(constraint='uq_attachment_blobs_scope_sha256'),
+                self._blob_buffer
+            )
+            self._blob_buffer = []
+        if rows:
+            self.db.execute(pg_insert(Evidence).on_conflict_do_nothing(index_elements=['id']), rows)
+        self._flush_index(stats)
+        
+        if self._checkpoint_document is not None:
+            folder_path, message_index = self._current_message
+            self._set_processing_meta(self._checkpoint_document, 'processing', checkpoint={
+                's3_key': self._checkpoint_key,
+                'folder_path': folder_path,
+                'message_index': message_index,
+                'messages_committed': self._position,
+                'stats': {key: stats[key] for key in ('total_emails', 'total_attachments', 'size_saved')},
+                'updated_at': datetime.utcnow().isoformat()
+            })
+        self.db.commit()
+        logger.debug(f"Committed {len(rows)} evidence rows ({self._position} messages processed)")
+    
+    def _process_attachments(self, message, document, case_id, company_id, stats, evidence_id) -> List[Dict]:
         """
         Extract and save ONLY the attachments (not the emails themselves)
         
+        Attachments are content-addressed: every attachment of the message is
+        hashed first, the hashes are looked up in attachment_blobs in one
+        query, and only content not already stored for this company (or case)
+        is uploaded to S3. Only the S3 object is shared - each import gets its
+        own attachment Document pointing at it. Document IDs are derived from
+        the email's evidence ID and the attachment index, like the evidence
+        ID itself, so re-processing a message doesn't duplicate them.
+        
         Returns list of attachment metadata dicts
         """
         attachments_info = []
         
+        # Pass 1: read and hash
+        pending = []
         for i in range(message.number_of_attachments):
             try:
                 attachment = message.get_attachment(i)
@@ -404,10 +796,22 @@ class UltimatePSTProcessor:
                 content_id = self._safe_get_attr(attachment, 'content_id', None)
                 is_inline = bool(content_id)
                 
-                # Read attachment data - pypff uses read_buffer method
+                # Read attachment data - pypff uses read_buffer method.
+                # Large attachments are only hashed here, in chunks, and
+                # re-read for upload so memory stays bounded.
                 attachment_data = None
+                file_hash = None
                 try:
-                    if hasattr(attachment, 'read_buffer'):
+                    if hasattr(attachment, 'read_buffer') and size > settings.PST_ATTACHMENT_STREAM_THRESHOLD:
+                        digest = hashlib.sha256()
+                        read = 0
+                        for chunk in self._iter_attachment_chunks(attachment, size):
+                            digest.update(chunk)
+                            read += len(chunk)
+                        if read:
+                            file_hash = digest.hexdigest()
+                            size = read
+                    elif hasattr(attachment, 'read_buffer'):
                         attachment_data = attachment.read_buffer(size)
                     elif hasattr(attachment, 'data'):
                         attachment_data = attachment.data
@@ -415,125 +819,254 @@ class UltimatePSTProcessor:
                     logger.warning(f"Could not read attachment {filename}: {e}, skipping")
                     continue
                 
-                if not attachment_data:
+                if attachment_data:
+                    # Calculate hash for deduplication
+                    file_hash = hashlib.sha256(attachment_data).hexdigest()
+                if not file_hash:
                     logger.warning(f"No data for attachment {filename}, skipping")
                     continue
                 
-                # Calculate hash for deduplication
-                file_hash = hashlib.sha256(attachment_data).hexdigest()
-                
-                # Check if we've already stored this attachment
+                pending.append({
+                    'index': i,
+                    'filename': filename,
+                    'size': size,
+                    'content_type': content_type,
+                    'content_id': content_id,
+                    'is_inline': is_inline,
+                    'attachment': attachment,
+                    'data': attachment_data,  # None when streamed
+                    'hash': file_hash
+                })
+            except Exception as e:
+                logger.error(f"Error processing attachment {i}: {e}", exc_info=True)
+                stats['errors'].append(f"Attachment {i}: {str(e)}")
+        
+        if not pending:
+            return attachments_info
+        
+        scope = self._attachment_scope(case_id, company_id)
+        self._lookup_attachment_blobs(scope, [att['hash'] for att in pending])
+        
+        # Pass 2: reuse or upload
+        for att in pending:
+            filename = att['filename']
+            file_hash = att['hash']
+            try:
+                # Check if this import already has a document for this content
                 if file_hash in self.attachment_hashes:
-                    # Use existing document
                     att_doc_id = self.attachment_hashes[file_hash]
                     logger.debug(f"Attachment {filename} is duplicate (hash={file_hash[:8]}), reusing doc {att_doc_id}")
                     
                     attachments_info.append({
                         'document_id': str(att_doc_id),
                         'filename': filename,
-                        'size': size,
-                        'content_type': content_type,
-                        'is_inline': is_inline,
-                        'content_id': content_id,
+                        'size': att['size'],
+                        'content_type': att['content_type'],
+                        'is_inline': att['is_inline'],
+                        'content_id': att['content_id'],
+                        'hash': file_hash,
                         'is_duplicate': True
                     })
                     continue
                 
-                # Generate unique S3 key
-                hash_prefix = file_hash[:8]
-                s3_key = f"attachments/{company_id}/{case_id}/{hash_prefix}_{filename}"
-                
-                # Upload to S3
-                try:
-                    self.s3.put_object(
-                        Bucket=settings.S3_BUCKET,
-                        Key=s3_key,
-                        Body=attachment_data,
-                        ContentType=content_type,
-                        Metadata={
-                            'original_filename': filename,
-                            'file_hash': file_hash,
-                            'case_id': str(case_id)
-                        }
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to upload attachment {filename} to S3: {e}")
-                    stats['errors'].append(f"Attachment upload failed: {filename}")
-                    continue
+                # Content stored by an earlier import is referenced, not uploaded again
+                s3_key = self._blob_keys.get(file_hash)
+                is_duplicate = s3_key is not None
+                if not is_duplicate:
+                    # Content-addressed S3 key, shared by every email in the scope
+                    s3_key = self._attachment_s3_key(case_id, company_id, file_hash)
+                    
+                    # Upload to S3
+                    metadata = {
+                        'original_filename': filename,
+                        'file_hash': file_hash,
+                        'case_id': str(case_id)
+                    }
+                    try:
+                        if att['data'] is None:
+                            self._upload_attachment_stream(att['attachment'], att['size'], s3_key, att['content_type'], metadata)
+                        else:
+                            self.s3.put_object(
+                                Bucket=settings.S3_BUCKET,
+                                Key=s3_key,
+                                Body=att['data'],
+                                ContentType=att['content_type'],
+                                Metadata=metadata
+                            )
+                    except Exception as e:
+                        logger.error(f"Failed to upload attachment {filename} to S3: {e}")
+                        stats['errors'].append(f"Attachment upload failed: {filename}")
+                        continue
                 
-                # Create Document record for attachment
-                att_doc = Document(
-                    filename=filename,
-                    content_type=content_type,
-                    size=size,
-                    bucket=settings.S3_BUCKET,
-                    s3_key=s3_key,
-                    status=DocStatus.READY,
-                    owner_user_id=document.owner_user_id,
-                    meta={
+                # Document record for the attachment, written with the next evidence batch
+                att_doc_id = uuid.uuid5(EVIDENCE_ID_NAMESPACE, f"{evidence_id}:attachment:{att['index']}")
+                self._attachment_buffer.append({
+                    'id': att_doc_id,
+                    'filename': filename,
+                    'content_type': att['content_type'],
+                    'size': att['size'],
+                    'bucket': settings.S3_BUCKET,
+                    's3_key': s3_key,
+                    'status': DocStatus.READY,
+                    'owner_user_id': document.owner_user_id,
+                    'meta': {
                         'is_email_attachment': True,
-                        'is_inline': is_inline,
-                        'content_id': content_id,
+                        'is_inline': att['is_inline'],
+                        'content_id': att['content_id'],
                         'file_hash': file_hash,
                         'parent_document_id': str(document.id),
                         'case_id': str(case_id) if case_id else None,
                         'company_id': str(company_id) if company_id else None
                     }
-                )
-                self.db.add(att_doc)
-                self.db.flush()
+                })
+                if not is_duplicate:
+                    self._blob_buffer.append({
+                        'id': uuid.uuid4(),
+                        'scope': scope,
+                        'sha256': file_hash,
+                        'document_id': att_doc_id,
+                        's3_key': s3_key,
+                        'size': att['size']
+                    })
+                    self._blob_keys[file_hash] = s3_key
                 
                 # Store for deduplication
-                self.attachment_hashes[file_hash] = att_doc.id
+                self.attachment_hashes[file_hash] = att_doc_id
                 
                 attachments_info.append({
-                    'document_id': str(att_doc.id),
+                    'document_id': str(att_doc_id),
                     'filename': filename,
-                    'size': size,
-                    'content_type': content_type,
-                    'is_inline': is_inline,
-                    'content_id': content_id,
+                    'size': att['size'],
+                    'content_type': att['content_type'],
+                    'is_inline': att['is_inline'],
+                    'content_id': att['content_id'],
                     's3_key': s3_key,
-                    'hash': file_hash
+                    'hash': file_hash,
+                    'is_duplicate': is_duplicate
                 })
                 
                 stats['total_attachments'] += 1
                 
             except Exception as e:
-                logger.error(f"Error processing attachment {i}: {e}", exc_info=True)
-                stats['errors'].append(f"Attachment {i}: {str(e)}")
+                logger.error(f"Error processing attachment {att['index']}: {e}", exc_info=True)
+                stats['errors'].append(f"Attachment {att['index']}: {str(e)}")
         
         return attachments_info
     
-    def _get_header(self, message, header_name: str) -> Optional[str]:
+    @staticmethod
+    def _iter_attachment_chunks(attachment, size: int, chunk_size: Optional[int] = None):
+        """Yield attachment content from the start in chunks of at most chunk_size bytes"""
+        chunk_size = chunk_size or settings.PST_ATTACHMENT_PART_SIZE
+        attachment.seek_offset(0, os.SEEK_SET)
+        remaining = size
+        while remaining > 0:
+            chunk = attachment.read_buffer(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    
+    def _upload_attachment_stream(self, attachment, size: int, s3_key: str, content_type: str, metadata: Dict):
+        """Upload a large attachment with S3 multipart upload, one part in memory at a time"""
+        # S3 requires every part but the last to be at least 5 MiB
+        part_size = max(settings.PST_ATTACHMENT_PART_SIZE, 5 * 1024 * 1024)
+        upload_id = self.s3.create_multipart_upload(
+            Bucket=settings.S3_BUCKET,
+            Key=s3_key,
+            ContentType=content_type,
+            Metadata=metadata
+        )['UploadId']
+        try:
+            parts = []
+            for part_number, chunk in enumerate(self._iter_attachment_chunks(attachment, size, part_size), start=1):
+                response = self.s3.upload_part(
+                    Bucket=settings.S3_BUCKET,
+                    Key=s3_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=chunk
+                )
+                parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+            self.s3.complete_multipart_upload(
+                Bucket=settings.S3_BUCKET,
+                Key=s3_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            try:
+                self.s3.abort_multipart_upload(Bucket=settings.S3_BUCKET, Key=s3_key, UploadId=upload_id)
+            except Exception as abort_error:
+                logger.warning(f"Could not abort multipart upload for {s3_key}: {abort_error}")
+            raise
+    
+    @staticmethod
+    def _attachment_scope(case_id, company_id) -> str:
+        if settings.ATTACHMENT_DEDUP_SCOPE == 'case':
+            return f"case:{case_id}"
+        return f"company:{company_id}"
+    
+    @staticmethod
+    def _attachment_s3_key(case_id, company_id, file_hash: str) -> str:
+        if settings.ATTACHMENT_DEDUP_SCOPE == 'case':
+            return f"attachments/{company_id}/{case_id}/sha256/{file_hash}"
+        return f"attachments/{company_id}/sha256/{file_hash}"
+    
+    def _lookup_attachment_blobs(self, scope: str, hashes: List[str]):
         """
-        Extract specific header from message transport headers
+        Load S3 keys of stored content for any hashes not already known to this run
+        
+        The rows are share-locked until the batch commits, so a concurrent
+        document delete can't remove the S3 object before this run's
+        documents referencing it are visible.
         """
+        missing = list({h for h in hashes if h not in self.attachment_hashes and h not in self._blob_keys})
+        if not missing:
+            return
+        for sha256, s3_key in self.db.query(AttachmentBlob.sha256, AttachmentBlob.s3_key).filter(
+            AttachmentBlob.scope == scope,
+            AttachmentBlob.sha256.in_(missing)
+        ).with_for_update(read=True):
+            self._blob_keys[sha256] = s3_key
+    
+    def _ensure_correspondence_index(self):
+        """Create the correspondence index once per run (idempotent across workers)"""
         try:
-            if hasattr(message, 'transport_headers') and message.transport_headers:
-                headers = message.transport_headers
-                # Parse headers (they come as one big string)
-                for line in headers.split('\n'):
-                    if line.startswith(f"{header_name}:"):
-                        value = line[len(header_name)+1:].strip()
-                        # Clean up angle brackets
-                        if value.startswith('<') and value.endswith('>'):
-                            value = value[1:-1]
-                        return value
+            if not self.opensearch.indices.exists(CORRESPONDENCE_INDEX):
+                self.opensearch.indices.create(
+                    CORRESPONDENCE_INDEX,
+                    body={
+                        'settings': {'number_of_shards': 1, 'number_of_replicas': 0},
+                        'mappings': {
+                            'properties': {
+                                'type': {'type': 'keyword'},
+                                'case_id': {'type': 'keyword'},
+                                'document_id': {'type': 'keyword'},
+                                'thread_id': {'type': 'keyword'},
+                                'message_id': {'type': 'keyword'},
+                                'date': {'type': 'date'},
+                                'content': {'type': 'text'},
+                                'subject': {'type': 'text'},
+                                'from': {'type': 'keyword'},
+                                'to': {'type': 'keyword'}
+                            }
+                        }
+                    },
+                    ignore=400  # Another worker may have created it in the meantime
+                )
         except Exception as e:
-            logger.debug(f"Could not extract header {header_name}: {e}")
-        return None
+            logger.warning(f"Could not ensure OpenSearch index '{CORRESPONDENCE_INDEX}': {e}")
     
-    def _index_to_opensearch(self, evidence: Evidence, email_data: Dict, content: str):
+    def _index_to_opensearch(self, evidence: Dict, email_data: Dict, content: str, stats: Dict):
         """
-        Index email to OpenSearch for full-text search
+        Queue email for bulk indexing to OpenSearch for full-text search
         """
         doc = {
-            'id': f"evidence_{evidence.id}",
+            'id': f"evidence_{evidence['id']}",
             'type': 'email',
-            'case_id': str(evidence.case_id),
-            'document_id': str(evidence.document_id),
-            'thread_id': evidence.thread_id,
+            'case_id': str(evidence['case_id']),
+            'document_id': str(evidence['document_id']),
+            'thread_id': evidence['thread_id'],
             'message_id': email_data['message_id'],
             'in_reply_to': email_data['in_reply_to'],
             'from': email_data['from'],
@@ -544,143 +1077,177 @@ class UltimatePSTProcessor:
             'content': content[:10000] if content else '',  # Truncate for indexing
             'folder_path': email_data['folder_path'],
             'has_attachments': email_data['has_attachments'],
-            'attachments_count': len(evidence.attachments) if evidence.attachments else 0,
+            'attachments_count': len(evidence['meta']['attachments']),
             'indexed_at': datetime.utcnow().isoformat()
         }
         
-        # Create index if not exists
-        index_name = 'correspondence'
-        if not self.opensearch.indices.exists(index_name):
-            self.opensearch.indices.create(
-                index_name,
-                body={
-                    'settings': {'number_of_shards': 1, 'number_of_replicas': 0},
-                    'mappings': {
-                        'properties': {
-                            'date': {'type': 'date'},
-                            'content': {'type': 'text'},
-                            'subject': {'type': 'text'},
-                            'from': {'type': 'keyword'},
-                            'to': {'type': 'keyword'}
-                        }
-                    }
-                }
-            )
+        self._index_buffer.append({
+            '_index': CORRESPONDENCE_INDEX,
+            '_id': doc['id'],
+            '_source': doc
+        })
+        self._index_buffer_bytes += len(json.dumps(doc, default=str))
         
-        # Index document
-        self.opensearch.index(
-            index=index_name,
-            body=doc,
-            id=f"evidence_{evidence.id}",
-            refresh=False  # Don't refresh immediately for performance
-        )
+        if (len(self._index_buffer) >= settings.PST_INDEX_BULK_DOCS
+                or self._index_buffer_bytes >= settings.PST_INDEX_BULK_BYTES):
+            self._flush_index(stats)
+    
+    def _flush_index(self, stats: Dict):
+        """
+        Send buffered documents to OpenSearch via _bulk
+        
+        Items rejected with 429 (bulk queue full) are retried with exponential
+        backoff by streaming_bulk; anything still failing is reported per item
+        in stats['errors'] rather than aborting the PST.
+        """
+        if not self._index_buffer:
+            return
+        actions = self._index_buffer
+        self._index_buffer = []
+        self._index_buffer_bytes = 0
+        
+        failed = 0
+        for ok, item in streaming_bulk(
+            self.opensearch,
+            actions,
+            chunk_size=settings.PST_INDEX_BULK_DOCS,
+            max_chunk_bytes=settings.PST_INDEX_BULK_BYTES,
+            max_retries=settings.PST_INDEX_MAX_RETRIES,
+            initial_backoff=settings.PST_INDEX_INITIAL_BACKOFF,
+            raise_on_error=False,
+            raise_on_exception=False,
+        ):
+            if not ok:
+                failed += 1
+                result = next(iter(item.values()), item)  # keyed by op type (index/update)
+                stats['errors'].append(
+                    f"OpenSearch indexing failed for {result.get('_id')}: {result.get('error') or result.get('status')}"
+                )
+        
+        bump_generation(CORRESPONDENCE_INDEX)
+        if failed:
+            logger.warning(f"{failed}/{len(actions)} documents failed to index into '{CORRESPONDENCE_INDEX}'")
+        else:
+            logger.debug(f"Bulk indexed {len(actions)} documents into '{CORRESPONDENCE_INDEX}'")
     
-    def _build_thread_relationships(self, case_id):
+    def _build_thread_relationships(self, case_id, document_id):
         """
         Build email thread relationships using multiple algorithms:
         1. In-Reply-To header (direct parent-child)
         2. References header (full thread chain)
         3. Outlook Conversation-Index (binary thread tree)
         4. Subject-based fallback (for emails without headers)
+        
+        See EmailThreader - this runs in a single linear pass. Only emails from
+        this PST are loaded; threads from earlier imports in the case are found
+        through the persisted email_thread_keys lookups.
         """
-        logger.info(f"Building thread relationships for case {case_id}")
+        logger.info(f"Building thread relationships for case {case_id}, document {document_id}")
         
-        # Get all evidence for this case
-        all_evidence = self.db.query(Evidence).filter_by(case_id=case_id).all()
+        rows = self._load_threading_rows(Evidence.document_id == document_id)
         
-        # Build message_id -> evidence mapping
-        msg_id_map = {
-            e.email_message_id: e 
-            for e in all_evidence 
-            if e.email_message_id
-        }
+        threader = EmailThreader()
+        self._load_thread_keys(threader, case_id, rows)
+        assignments = threader.assign(rows)
+        if assignments:
+            self.db.execute(
+                update(Evidence),
+                [{'id': evidence_id, 'thread_id': thread_id} for evidence_id, thread_id in assignments.items()]
+            )
+        self._save_thread_keys(case_id, threader.new_keys)
         
-        threads_found = {}
+        # Commit all thread assignments
+        self.db.commit()
+        self._index_thread_ids(assignments)
         
-        for evidence in all_evidence:
-            # Skip if already assigned to a thread
-            if evidence.thread_id:
+        thread_ids = set()
+        for row in rows:
+            thread_id = assignments.get(row['id']) or row['thread_id']
+            if not thread_id:
                 continue
-            
-            thread_id = None
-            
-            # Strategy 1: Use In-Reply-To header
-            if evidence.email_in_reply_to and evidence.email_in_reply_to in msg_id_map:
-                parent = msg_id_map[evidence.email_in_reply_to]
-                if parent.thread_id:
-                    thread_id = parent.thread_id
-                else:
-                    # Create new thread starting from parent
-                    thread_id = f"thread_{hashlib.md5(parent.email_message_id.encode()).hexdigest()[:12]}"
-                    parent.thread_id = thread_id
-            
-            # Strategy 2: Parse References header for full thread chain
-            if not thread_id and evidence.meta and evidence.meta.get('references'):
-                refs = evidence.meta['references'].split()
-                for ref in refs:
-                    if ref in msg_id_map:
-                        parent = msg_id_map[ref]
-                        if parent.thread_id:
-                            thread_id = parent.thread_id
-                            break
-            
-            # Strategy 3: Outlook Conversation-Index
-            if not thread_id and evidence.email_conversation_index:
-                # First 22 chars (11 bytes) of conversation index is the thread root
-                conv_root = evidence.email_conversation_index[:22]
-                if conv_root in threads_found:
-                    thread_id = threads_found[conv_root]
-                else:
-                    thread_id = f"thread_{conv_root}"
-                    threads_found[conv_root] = thread_id
-            
-            # Strategy 4: Subject-based fallback (normalize subject)
-            if not thread_id and evidence.email_subject:
-                # Normalize subject (remove Re:, Fwd:, etc.)
-                normalized_subject = evidence.email_subject.lower()
-                for prefix in ['re:', 'fw:', 'fwd:', 'aw:']:
-                    normalized_subject = normalized_subject.replace(prefix, '').strip()
-                
-                # Check if any existing thread has this subject
-                for other in all_evidence:
-                    if other.thread_id and other.email_subject:
-                        other_normalized = other.email_subject.lower()
-                        for prefix in ['re:', 'fw:', 'fwd:', 'aw:']:
-                            other_normalized = other_normalized.replace(prefix, '').strip()
-                        
-                        if normalized_subject == other_normalized:
-                            thread_id = other.thread_id
-                            break
-            
-            # Create new thread if no match found
-            if not thread_id and evidence.email_message_id:
-                thread_id = f"thread_{hashlib.md5(evidence.email_message_id.encode()).hexdigest()[:12]}"
-            
-            # Assign thread ID
-            if thread_id:
-                evidence.thread_id = thread_id
+            thread_ids.add(thread_id)
+            if row['message_id'] in self.threads_map:
+                self.threads_map[row['message_id']]['thread_id'] = thread_id
         
-        # Commit all thread assignments
-        self.db.commit()
+        logger.info(f"Thread building complete. Found {len(thread_ids)} unique threads")
+    
+    def _index_thread_ids(self, assignments: Dict):
+        """
+        Copy new thread assignments onto the indexed emails
         
-        logger.info(f"Thread building complete. Found {len(set(e.thread_id for e in all_evidence if e.thread_id))} unique threads")
+        Emails are indexed during extraction, before threads are built, so
+        their thread_id is only filled in here (needed for thread facets).
+        """
+        if not self.opensearch or not assignments:
+            return
+        for evidence_id, thread_id in assignments.items():
+            self._index_buffer.append({
+                '_op_type': 'update',
+                '_index': CORRESPONDENCE_INDEX,
+                '_id': f"evidence_{evidence_id}",
+                'doc': {'thread_id': thread_id}
+            })
+        stats = {'errors': []}
+        self._flush_index(stats)
+        for error in stats['errors'][:10]:
+            logger.warning(error)
+    
+    def _load_threading_rows(self, *criteria) -> List[Dict]:
+        """Load only the threading columns - meta also holds full email bodies"""
+        return [
+            dict(row._mapping)
+            for row in self.db.query(
+                Evidence.id,
+                Evidence.email_message_id.label('message_id'),
+                Evidence.email_in_reply_to.label('in_reply_to'),
+                Evidence.meta['references'].as_string().label('references'),
+                Evidence.email_conversation_index.label('conversation_index'),
+                Evidence.email_subject.label('subject'),
+                Evidence.email_date.label('date'),
+                Evidence.thread_id,
+            ).filter(*criteria)
+        ]
     
-    def _extract_email_from_headers(self, message):
+    def _load_thread_keys(self, threader: EmailThreader, case_id, rows: List[Dict]):
         """
-        Extract email address from RFC 2822 transport headers
-        pypff doesn't expose direct .sender_email_address - parse from headers
+        Seed the threader with stored lookups relevant to the new rows
+        
+        Cases threaded before email_thread_keys existed have no keys yet; for
+        those the already-threaded emails are registered once and their keys
+        persisted with this run.
         """
-        import re
-        try:
-            headers = message.transport_headers
-            if not headers:
-                return None
-            
-            # Parse From: header - format is "Name <email@domain.com>" or just "email@domain.com"
-            from_match = re.search(r'From:\s*(?:.*?<)?([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)', headers, re.IGNORECASE)
-            if from_match:
-                return from_match.group(1)
-            
-            return None
-        except:
-            return None
+        has_keys = self.db.query(EmailThreadKey.id).filter(EmailThreadKey.case_id == case_id).first()
+        if not has_keys:
+            legacy_rows = self._load_threading_rows(
+                Evidence.case_id == case_id,
+                Evidence.thread_id.isnot(None)
+            )
+            if legacy_rows:
+                logger.info(f"Backfilling thread keys from {len(legacy_rows)} threaded emails in case {case_id}")
+                threader.assign(legacy_rows)
+            return
+        
+        for key_type, keys in EmailThreader.lookup_keys(rows).items():
+            keys = list(keys)
+            for i in range(0, len(keys), self.batch_size):
+                chunk = keys[i:i + self.batch_size]
+                for key, thread_id in self.db.query(EmailThreadKey.key, EmailThreadKey.thread_id).filter(
+                    EmailThreadKey.case_id == case_id,
+                    EmailThreadKey.key_type == key_type,
+                    EmailThreadKey.key.in_(chunk)
+                ):
+                    threader.load(key_type, key, thread_id)
+    
+    def _save_thread_keys(self, case_id, new_keys: Dict):
+        """Persist new thread lookups (first writer wins on conflicts)"""
+        values = [
+            {'id': uuid.uuid4(), 'case_id': case_id, 'key_type': key_type, 'key': key, 'thread_id': thread_id}
+            for (key_type, key), thread_id in new_keys.items()
+            if len(key) <= EmailThreadKey.key.type.length
+        ]
+        for i in range(0, len(values), self.batch_size):
+            self.db.execute(
+                pg_insert(EmailThreadKey.__table__)
+                .values(values[i:i + self.batch_size])
+                .on_conflict_do_nothing(constraint='uq_email_thread_keys_case_key')
+            )
@@ -0,0 +1,232 @@
+"""
+Zero-downtime rebuild of the documents index
+
+settings.OPENSEARCH_INDEX is an alias over versioned physical indices
+(documents_v1, documents_v2, ...). reindex() creates the next version with
+the current mapping and SEARCH_INDEX_SHARDS/SEARCH_INDEX_REPLICAS, fills it
+from the live version with parallel sliced scrolls, and swaps the alias in
+one atomic _aliases call. Text comes from extraction_cache (via each
+document's content_sha256) or, for documents indexed before that existed,
+from the stored source - nothing is re-extracted or OCR'd.
+
+Writes keep landing in the live version while the copy runs. They are
+caught up by indexed_at just before and after the swap, and documents
+deleted in the meantime are removed from the new version.
+
+The first run migrates a pre-alias concrete index, which the swap itself
+must delete, so nothing written to it afterwards could be caught up. Its
+writes are blocked from the final catch-up until the swap (normally a
+second or two): the worker re-buffers blocked bulk items and they land in
+the new version through the alias, but a delete from the API in that
+window is only logged and leaves the document in the new version.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from opensearchpy.helpers import streaming_bulk
+from sqlalchemy import select
+
+from . import search_cache
+from .config import settings
+from .db import SessionLocal
+from .models import ExtractionCache
+from .search import chunk_text, client, index_body, path_root, versioned_index_name
+
+logger = logging.getLogger(__name__)
+
+_SCROLL = "5m"
+_BATCH = 500
+# Slack for clock skew between writers' indexed_at and this job
+_CATCH_UP_MARGIN = timedelta(minutes=1)
+
+
+def current_index() -> Optional[str]:
+    """Physical index the alias points at (or the pre-alias concrete index)"""
+    c = client()
+    alias = settings.OPENSEARCH_INDEX
+    if c.indices.exists_alias(name=alias):
+        return next(iter(c.indices.get_alias(name=alias)))
+    if c.indices.exists(index=alias):
+        return alias
+    return None
+
+
+def _next_version() -> int:
+    prefix = f"{settings.OPENSEARCH_INDEX}_v"
+    versions = [int(name[len(prefix):]) for name in client().indices.get(index=prefix + "*")
+                if name[len(prefix):].isdigit()]
+    return max(versions, default=0) + 1
+
+
+def rebuild_source(src: Dict, texts: Dict[str, str]) -> Dict:
+    """
+    Source for the new version of an indexed document
+
+    Chunks are rebuilt from the cached extraction when there is one, else
+    from a legacy unchunked "text" field; otherwise existing chunks are kept.
+    """
+    doc = dict(src)
+    text = texts.get(src.get("content_sha256") or "")
+    if text is None:
+        text = doc.get("text") or None
+    if text is not None:
+        doc["chunks"] = chunk_text(text)
+        doc.pop("text", None)
+    doc["path_root"] = path_root(doc.get("path"))
+    return doc
+
+
+def _cached_texts(hashes: Iterable[str]) -> Dict[str, str]:
+    hashes = [h for h in set(hashes) if h]
+    if not hashes:
+        return {}
+    with SessionLocal() as db:
+        return dict(db.execute(
+            select(ExtractionCache.sha256, ExtractionCache.text).where(ExtractionCache.sha256.in_(hashes))
+        ).all())
+
+
+def _scan(index: str, query: Dict, source=True, slice_id: int = 0, slices: int = 1) -> Iterator[List[Dict]]:
+    """Yield batches of hits from a (sliced) scroll"""
+    c = client()
+    body = {"query": query, "size": _BATCH, "sort": ["_doc"], "_source": source}
+    if slices > 1:
+        body["slice"] = {"id": slice_id, "max": slices}
+    res = c.search(index=index, body=body, scroll=_SCROLL)
+    try:
+        while res["hits"]["hits"]:
+            yield res["hits"]["hits"]
+            res = c.scroll(scroll_id=res["_scroll_id"], scroll=_SCROLL)
+    finally:
+        if res.get("_scroll_id"):
+            c.clear_scroll(scroll_id=res["_scroll_id"], ignore=(404,))
+
+
+def _bulk(actions: Iterable[Dict]) -> Tuple[int, int]:
+    ok = failed = 0
+    for success, item in streaming_bulk(client(), actions, chunk_size=_BATCH, max_retries=3,
+                                        raise_on_error=False, raise_on_exception=False):
+        if success:
+            ok += 1
+        else:
+            failed += 1
+            logger.warning("Reindex bulk item failed: %s", item)
+    return ok, failed
+
+
+def _copy_hits(hits: List[Dict], target: str) -> Tuple[int, int]:
+    texts = _cached_texts(h["_source"].get("content_sha256") for h in hits)
+    return _bulk({"_index": target, "_id": h["_id"], "_source": rebuild_source(h["_source"], texts)} for h in hits)
+
+
+def _copy_slice(source: str, target: str, slice_id: int, slices: int) -> Tuple[int, int]:
+    ok = failed = 0
+    for hits in _scan(source, {"match_all": {}}, slice_id=slice_id, slices=slices):
+        copied, errors = _copy_hits(hits, target)
+        ok += copied
+        failed += errors
+    return ok, failed
+
+
+def _timestamp(value) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _catch_up(source: str, target: str, since: datetime) -> int:
+    """Copy documents written to source since `since` unless target already has a newer copy"""
+    copied = 0
+    query = {"range": {"indexed_at": {"gte": since.isoformat()}}}
+    for hits in _scan(source, query):
+        docs = client().mget(index=target, body={"ids": [h["_id"] for h in hits]},
+                             _source_includes=["indexed_at"])["docs"]
+        in_target = {d["_id"]: _timestamp(d["_source"].get("indexed_at")) for d in docs if d.get("found")}
+        stale = [h for h in hits
+                 if h["_id"] not in in_target or _timestamp(h["_source"].get("indexed_at")) > in_target[h["_id"]]]
+        copied += _copy_hits(stale, target)[0]
+    return copied
+
+
+def _remove_deleted(source: str, target: str, before: datetime) -> int:
+    """Delete from target documents copied from source that have since been deleted there"""
+    live = set()
+    for hits in _scan(source, {"match_all": {}}, source=False):
+        live.update(h["_id"] for h in hits)
+    cutoff = before.timestamp()
+    gone = []
+    for hits in _scan(target, {"match_all": {}}, source=["indexed_at"]):
+        gone.extend(h["_id"] for h in hits
+                    if h["_id"] not in live and _timestamp(h["_source"].get("indexed_at")) < cutoff)
+    if gone:
+        _bulk({"_op_type": "delete", "_index": target, "_id": doc_id} for doc_id in gone)
+    return len(gone)
+
+
+def reindex(slices: Optional[int] = None) -> Dict:
+    """Build the next index version from the live one and point the alias at it"""
+    c = client()
+    alias = settings.OPENSEARCH_INDEX
+    source = current_index()
+    if source is None:
+        raise RuntimeError(f"No index or alias named '{alias}' to rebuild")
+    target = versioned_index_name(_next_version())
+    slices = max(1, slices or settings.SEARCH_REINDEX_SLICES)
+    started = datetime.now(timezone.utc)
+    logger.info("Reindexing %s -> %s with %d slices", source, target, slices)
+
+    c.indices.create(index=target, body=index_body(building=True))
+    with ThreadPoolExecutor(max_workers=slices) as pool:
+        results = list(pool.map(lambda i: _copy_slice(source, target, i, slices), range(slices)))
+    copied = sum(ok for ok, _ in results)
+    failed = sum(errors for _, errors in results)
+    if failed:
+        # Never swap to an incomplete index
+        c.indices.delete(index=target, ignore=(404,))
+        raise RuntimeError(f"Reindex into {target} aborted: {failed} documents failed to copy")
+
+    # The slow passes (full scans, restoring replicas) run first; each catch-up only
+    # rescans what was written since the previous one started
+    since = datetime.now(timezone.utc)
+    removed = _remove_deleted(source, target, since)
+    caught_up = _catch_up(source, target, started - _CATCH_UP_MARGIN)
+    c.indices.put_settings(index=target, body={"index": {"number_of_replicas": settings.SEARCH_INDEX_REPLICAS,
+                                                         "refresh_interval": None}})
+    c.indices.refresh(index=target)
+
+    legacy = source == alias
+    if legacy:
+        c.indices.put_settings(index=source, body={"index": {"blocks.write": True}})
+    try:
+        # Immediately before the swap, so all that can be missed is what lands during the swap call
+        checkpoint, since = since, datetime.now(timezone.utc)
+        caught_up += _catch_up(source, target, checkpoint - _CATCH_UP_MARGIN)
+        if legacy:
+            if settings.SEARCH_REINDEX_KEEP_OLD:
+                # Hard-linked, read-only copy of the concrete index for rollback
+                c.indices.clone(index=source, target=versioned_index_name(0))
+            # Its name has to be free to become the alias
+            actions = [{"add": {"index": target, "alias": alias}}, {"remove_index": {"index": source}}]
+        else:
+            actions = [{"remove": {"index": source, "alias": alias}}, {"add": {"index": target, "alias": alias}}]
+        c.indices.update_aliases(body={"actions": actions})
+    except Exception:
+        if legacy:
+            c.indices.put_settings(index=source, body={"index": {"blocks.write": None}})
+        raise
+    swapped = datetime.now(timezone.utc)
+    logger.info("Alias %s now points at %s", alias, target)
+
+    if not legacy:
+        # Writes that reached the old version during the swap
+        caught_up += _catch_up(source, target, since - _CATCH_UP_MARGIN)
+        removed += _remove_deleted(source, target, swapped - _CATCH_UP_MARGIN)
+        if not settings.SEARCH_REINDEX_KEEP_OLD:
+            c.indices.delete(index=source)
+    search_cache.bump_generation(alias)
+
+    return {"source": source, "target": target, "copied": copied, "caught_up": caught_up, "removed": removed,
+            "slices": slices, "seconds": round((datetime.now(timezone.utc) - started).total_seconds(), 1)}
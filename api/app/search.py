@@ -1,8 +1,12 @@
+import base64
+import json
 import logging
 import time
+from datetime import datetime, timezone
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from opensearchpy.exceptions import NotFoundError
 from .config import settings
+from . import search_cache
 _client=None
 
 logger = logging.getLogger(__name__)
@@ -18,19 +22,79 @@ def client():
             connection_class=RequestsHttpConnection
         )
     return _client
+# Extracted text is indexed as nested windows so queries and highlighting only touch
+# the matching chunks, never a whole multi-MB document. "text" is kept in the mapping
+# for documents indexed before chunking.
+CHUNKS_MAPPING={"type":"nested","properties":{
+    "ordinal":{"type":"integer"},
+    "page":{"type":"integer"},
+    "text":{"type":"text","analyzer":"english"}
+}}
+def _break_at_space(text: str, lo: int, hi: int) -> int:
+    """Last whitespace position in text[lo:hi], or -1"""
+    return max(text.rfind(" ", lo, hi), text.rfind("\n", lo, hi), text.rfind("\f", lo, hi))
+def chunk_text(text: str, size: int|None=None, overlap: int|None=None, max_chunks: int|None=None) -> list:
+    """
+    Split text into overlapping windows for the nested "chunks" field
+
+    Each chunk records its ordinal and 1-based page (pages are separated by
+    form feeds, as Tika and the OCR sidecar emit). Windows grow if needed so a
+    document never exceeds max_chunks nested objects.
+    """
+    if not text or not text.strip():
+        return []
+    size = size or settings.SEARCH_CHUNK_CHARS
+    overlap = settings.SEARCH_CHUNK_OVERLAP if overlap is None else overlap
+    max_chunks = max_chunks or settings.SEARCH_MAX_CHUNKS
+    n = len(text)
+    # Worst-case stride is size/4 (word break at the midpoint, then overlap)
+    size = max(size, -(-n // max_chunks) * 4)
+    overlap = min(overlap, size // 4)
+    chunks = []; start = 0; page = 1; counted = 0
+    while start < n:
+        end = min(start + size, n)
+        if end < n:
+            # Break between words where possible
+            ws = _break_at_space(text, start + size // 2, end)
+            if ws > start: end = ws
+        page += text.count("\f", counted, start); counted = start
+        piece = text[start:end]
+        if piece.strip():
+            chunks.append({"ordinal": len(chunks), "page": page, "text": piece})
+        if end >= n:
+            break
+        next_start = max(end - overlap, start + 1)
+        # Start the overlap on a word boundary too
+        ws = text.find(" ", next_start, end)
+        start = ws + 1 if ws != -1 else next_start
+    return chunks
+DOCUMENT_MAPPINGS={"properties":{
+    "id":{"type":"keyword"},
+    "filename":{"type":"text"},
+    "title":{"type":"text"},
+    "path":{"type":"keyword"},
+    "path_root":{"type":"keyword"},
+    "owner":{"type":"keyword"},
+    "content_type":{"type":"keyword"},
+    "uploaded_at":{"type":"date"},
+    "indexed_at":{"type":"date"},
+    # Key into extraction_cache, so the index can be rebuilt without re-extracting
+    "content_sha256":{"type":"keyword","index":False},
+    "metadata":{"type":"object","enabled":True},
+    "text":{"type":"text","analyzer":"english"},
+    "chunks":CHUNKS_MAPPING
+}}
+# Fields added since the first mapping; put_mapping adds them to older indices in place
+_ADDED_FIELDS=("chunks","path_root","indexed_at","content_sha256")
+def versioned_index_name(version: int) -> str:
+    """Physical index behind the settings.OPENSEARCH_INDEX alias"""
+    return f"{settings.OPENSEARCH_INDEX}_v{version}"
+def index_body(building: bool=False) -> dict:
+    """Settings and mappings for a new physical documents index; building defers replicas and refreshes"""
+    index={"number_of_shards":settings.SEARCH_INDEX_SHARDS,"number_of_replicas":settings.SEARCH_INDEX_REPLICAS}
+    if building: index.update({"number_of_replicas":0,"refresh_interval":"-1"})
+    return {"settings":{"index":index},"mappings":DOCUMENT_MAPPINGS}
 def ensure_index():
-    body={"settings":{"index":{"number_of_shards":1,"number_of_replicas":0}},
-          "mappings":{"properties":{
-              "id":{"type":"keyword"},
-              "filename":{"type":"text"},
-              "title":{"type":"text"},
-              "path":{"type":"keyword"},
-              "owner":{"type":"keyword"},
-              "content_type":{"type":"keyword"},
-              "uploaded_at":{"type":"date"},
-              "metadata":{"type":"object","enabled":True},
-              "text":{"type":"text","analyzer":"english"}
-          }}}
     # Wait for OpenSearch to be reachable and ensure index
     # In AWS mode, make this non-blocking to allow API to start even if OpenSearch is temporarily unavailable
     deadline = time.time() + 15  # Shorter timeout for faster startup
@@ -39,7 +103,15 @@ def ensure_index():
         try:
             c = client()
             if not c.indices.exists(settings.OPENSEARCH_INDEX):
-                c.indices.create(index=settings.OPENSEARCH_INDEX, body=body)
+                # Searches and writes go through the alias; reindex.py swaps it to a new version
+                c.indices.create(index=versioned_index_name(1), body=index_body(),
+                                 ignore=400)  # Another API process may be creating it
+                c.indices.put_alias(index=versioned_index_name(1), name=settings.OPENSEARCH_INDEX)
+            else:
+                # Adding a field is non-breaking, so older indices pick up new fields in place.
+                # A pre-alias concrete index keeps working until the first reindex migrates it.
+                c.indices.put_mapping(index=settings.OPENSEARCH_INDEX, body={"properties":{
+                    name: DOCUMENT_MAPPINGS["properties"][name] for name in _ADDED_FIELDS}})
             logger.info("OpenSearch index '%s' is ready", settings.OPENSEARCH_INDEX)
             return
         except Exception as e:
@@ -50,42 +122,277 @@ def ensure_index():
     if last_err:
         logger.warning("Failed to initialize OpenSearch index (search will be unavailable): %s", last_err)
         logger.warning("API will start anyway - OpenSearch features disabled until connectivity is restored")
+def path_root(path: str|None) -> str|None:
+    """Top-level folder of a document path, indexed for the path facet"""
+    root=(path or "").strip("/").split("/")[0]
+    return root or None
+def document_body(doc) -> dict:
+    return {"id":str(doc["id"]),"filename":doc["filename"],"title":doc.get("title"),
+            "path":doc.get("path"),"path_root":path_root(doc.get("path")),"owner":doc.get("owner_user_id"),
+            "content_type":doc.get("content_type"),"uploaded_at":doc.get("created_at"),
+            "indexed_at":datetime.now(timezone.utc).isoformat(),"content_sha256":doc.get("content_sha256"),
+            "metadata":doc.get("metadata",{}),"chunks":chunk_text(doc.get("text",""))}
 def index_document(doc):
-    body={"id":str(doc["id"]),"filename":doc["filename"],"title":doc.get("title"),
-          "path":doc.get("path"),"owner":doc.get("owner_user_id"),
-          "content_type":doc.get("content_type"),"uploaded_at":doc.get("created_at"),
-          "metadata":doc.get("metadata",{}),"text":doc.get("text","")}
-    client().index(index=settings.OPENSEARCH_INDEX, id=str(doc["id"]), body=body, refresh=True)
-def search(query: str, size: int=25, path_prefix: str|None=None, owner: str|None=None):
-    must=[{"multi_match":{"query":query,"fields":["text^3","filename","title","metadata.*"]}}]
-    if path_prefix: must.append({"prefix":{"path": path_prefix}})
-    if owner: must.append({"term":{"owner": owner}})
-    dsl={
-        "size": size,
-        "query": {"bool": {"must": must}},
-        "highlight": {
-            "fields": {
-                "text": {
-                    "fragment_size": 200,
-                    "number_of_fragments": 3,
-                    "no_match_size": 200
-                }
-            },
-            "max_analyzed_offset": 1000000
-        }
+    body=document_body(doc)
+    # Never force a refresh per document - the index refresh_interval (or the worker's
+    # periodic refresh) makes it searchable; wait_for blocks until that happens
+    if settings.OPENSEARCH_REFRESH == "wait_for":
+        client().index(index=settings.OPENSEARCH_INDEX, id=str(doc["id"]), body=body, refresh="wait_for")
+    else:
+        client().index(index=settings.OPENSEARCH_INDEX, id=str(doc["id"]), body=body)
+    search_cache.bump_generation(settings.OPENSEARCH_INDEX)
+DOCUMENT_FIELDS=["text^3","filename","title","metadata.*"]
+EMAIL_FIELDS=["content^3","subject^2","from","to","cc"]
+def _text_query(query: str, highlight: bool=True, fields: list=DOCUMENT_FIELDS) -> dict:
+    """Match chunks (rolled up to their parent document) or the parent's own fields"""
+    inner_hits={"size":3,"_source":["chunks.ordinal","chunks.page"]}
+    if highlight:
+        # Each chunk is only a few KB, so highlighting is cheap and reaches the whole document
+        inner_hits["highlight"]={"fields":{"chunks.text":{"fragment_size":200,"number_of_fragments":1}}}
+    return {"bool":{"should":[
+        {"nested":{"path":"chunks","score_mode":"max","ignore_unmapped":True,
+                   "query":{"match":{"chunks.text":{"query":query,"boost":3}}},
+                   "inner_hits":inner_hits}},
+        {"multi_match":{"query":query,"fields":fields}}
+    ],"minimum_should_match":1}}
+def hit_snippets(hit: dict) -> tuple:
+    """Highlight fragments and matching page numbers for a search hit"""
+    highlight=hit.get("highlight",{})
+    fragments=highlight.get("text",[])+highlight.get("content",[]); pages=[]
+    for chunk in hit.get("inner_hits",{}).get("chunks",{}).get("hits",{}).get("hits",[]):
+        fragments.extend(chunk.get("highlight",{}).get("chunks.text",[]))
+        page=chunk.get("_source",{}).get("page")
+        if page and page not in pages: pages.append(page)
+    return fragments, sorted(pages)
+class CursorError(ValueError):
+    """Malformed or expired search cursor"""
+def encode_cursor(pit_id: str|None, after: list) -> str:
+    raw=json.dumps({"pit": pit_id, "after": after}, separators=(",",":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+def decode_cursor(cursor: str) -> dict:
+    try:
+        data=json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(data.get("after"), list): raise ValueError
+        return data
+    except (ValueError, TypeError, AttributeError):
+        raise CursorError("invalid cursor")
+def _open_pit() -> str|None:
+    try:
+        return client().create_point_in_time(index=settings.OPENSEARCH_INDEX, keep_alive=settings.SEARCH_PIT_KEEP_ALIVE)["pit_id"]
+    except Exception as e:
+        # search_after alone still pages at constant cost, just without a frozen view
+        logger.warning("Point-in-time unavailable, paging without it: %s", e)
+        return None
+def _close_pit(pit_id: str|None):
+    if not pit_id: return
+    try: client().delete_point_in_time(body={"pit_id": [pit_id]})
+    except Exception: logger.debug("Failed to close point-in-time %s", pit_id, exc_info=True)
+def _document_filters(path_prefix: str|None=None, owner: str|None=None, content_type: str|None=None,
+                      uploaded_from: str|None=None, uploaded_to: str|None=None) -> list:
+    """Facet selections as non-scoring (cacheable) filter clauses"""
+    filters=[]
+    if path_prefix: filters.append({"prefix":{"path": path_prefix}})
+    if owner: filters.append({"term":{"owner": owner}})
+    if content_type: filters.append({"term":{"content_type": content_type}})
+    if uploaded_from or uploaded_to:
+        bounds={}
+        if uploaded_from: bounds["gte"]=uploaded_from
+        if uploaded_to: bounds["lte"]=uploaded_to
+        filters.append({"range":{"uploaded_at": bounds}})
+    return filters
+def _document_facets(interval: str) -> dict:
+    return {
+        "content_type":{"terms":{"field":"content_type","size":20}},
+        "path":{"terms":{"field":"path_root","size":20}},
+        "owner":{"terms":{"field":"owner","size":20}},
+        "uploaded_at":{"date_histogram":{"field":"uploaded_at","calendar_interval":interval,"min_doc_count":1}}
     }
+def search(query: str, size: int=25, path_prefix: str|None=None, owner: str|None=None, cursor: str|None=None,
+           content_type: str|None=None, uploaded_from: str|None=None, uploaded_to: str|None=None,
+           interval: str="month"):
+    """
+    One page of document search results
+
+    Pages are read with search_after against a point-in-time, so every page
+    costs the same however deep it is and results don't shift while new
+    documents are indexed. The PIT is only opened when a second page is
+    actually requested, so searches nobody pages through never hold one
+    (OpenSearch caps open PITs per node). The response gains
+    "next_cursor": pass it back (with the same query) for the next page;
+    None on the last page.
+
+    The first page also carries content_type, top-level path, owner and
+    uploaded_at (per interval) aggregations, computed in the same request.
+    Only the first page counts total hits; later pages have no hits.total.
+    """
+    cache_key=None
+    if cursor is None:
+        # Only first pages are cached; later pages are bound to their point-in-time
+        cached, cache_key = search_cache.lookup("documents", [settings.OPENSEARCH_INDEX], query, {
+            "size": size, "path_prefix": path_prefix, "owner": owner, "content_type": content_type,
+            "uploaded_from": uploaded_from, "uploaded_to": uploaded_to, "interval": interval})
+        if cached is not None: return cached
+    page=decode_cursor(cursor) if cursor else {"pit": None, "after": None}
+    if cursor and not page["pit"]:
+        # First request past page one: freeze the view from here on
+        page["pit"]=_open_pit()
+    must=[_text_query(query)]
+    filters=_document_filters(path_prefix, owner, content_type, uploaded_from, uploaded_to)
+    def body(highlight: bool) -> dict:
+        dsl={
+            "size": size,
+            "query": {"bool": {"must": must, "filter": filters}},
+            "_source": {"excludes": ["text","chunks"]},
+            # id breaks score ties so search_after is stable
+            "sort": [{"_score": {"order": "desc"}}, {"id": {"order": "asc"}}],
+            # Exact totals on the first page only; later pages skip the count
+            "track_total_hits": cursor is None
+        }
+        if page["pit"]: dsl["pit"]={"id": page["pit"], "keep_alive": settings.SEARCH_PIT_KEEP_ALIVE}
+        if page["after"]: dsl["search_after"]=page["after"]
+        if cursor is None: dsl["aggs"]=_document_facets(interval)
+        if highlight:
+            dsl["highlight"]={
+                "fields": {
+                    # Legacy, unchunked documents only
+                    "text": {
+                        "fragment_size": 200,
+                        "number_of_fragments": 3
+                    }
+                },
+                "max_analyzed_offset": 1000000
+            }
+        return dsl
+    # With a point-in-time the index comes from the PIT
+    params={} if page["pit"] else {"index": settings.OPENSEARCH_INDEX}
     try:
-        return client().search(index=settings.OPENSEARCH_INDEX, body=dsl)
+        res=client().search(body=body(True), **params)
+    except NotFoundError:
+        # A missing PIT means the cursor outlived its keep-alive; anything else is a real error
+        if cursor: raise CursorError("cursor expired")
+        raise
     except Exception as e:
         logger.warning("Search with highlighting failed, retrying without highlights: %s", e)
         # Retry without highlighting if it fails
-        dsl_no_highlight = {"size": size, "query": {"bool": {"must": must}}}
-        return client().search(index=settings.OPENSEARCH_INDEX, body=dsl_no_highlight)
+        must[0] = _text_query(query, highlight=False)
+        res=client().search(body=body(False), **params); cache_key=None
+    hits=res.get("hits",{}).get("hits",[])
+    pit_id=res.get("pit_id") or page["pit"]
+    if len(hits) < size:
+        _close_pit(pit_id); res["next_cursor"]=None
+    else:
+        res["next_cursor"]=encode_cursor(pit_id, hits[-1]["sort"])
+    # First pages carry no PIT, so the cached copy's cursor stays valid as long as the entry
+    search_cache.store(cache_key, res)
+    return res
 
 def delete_document(doc_id: str):
     try:
         client().delete(index=settings.OPENSEARCH_INDEX, id=doc_id, ignore=[404])
+        search_cache.bump_generation(settings.OPENSEARCH_INDEX)
     except NotFoundError:
         return
     except Exception:
         logger.exception("Failed to delete document %s from OpenSearch", doc_id)
+
+_MAIL_KEYWORDS=("case_id","thread_id")
+_mail_fields={"checked":0.0,"fields":None}
+def _correspondence_fields() -> dict:
+    """
+    Exact-match field for case_id/thread_id in the correspondence index
+
+    Indices created before these were mapped as keyword have dynamic text
+    mappings - UUIDs are split on hyphens, so term filters match nothing -
+    and are queried through their .keyword sub-field instead. None means the
+    property is text with no keyword sub-field. Re-checked every few minutes.
+    """
+    if _mail_fields["fields"] is not None and time.time()-_mail_fields["checked"] < 300:
+        return _mail_fields["fields"]
+    fields={name: name for name in _MAIL_KEYWORDS}
+    try:
+        res=client().indices.get_field_mapping(index=settings.CORRESPONDENCE_INDEX, fields=",".join(_MAIL_KEYWORDS))
+        for index_mapping in res.values():
+            for name, entry in index_mapping.get("mappings",{}).items():
+                mapping=entry.get("mapping",{}).get(name,{})
+                if mapping.get("type") not in (None,"keyword"):
+                    fields[name]=f"{name}.keyword" if mapping.get("fields",{}).get("keyword",{}).get("type")=="keyword" else None
+    except NotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Could not read the correspondence mapping: %s", e)
+        return fields
+    if any(field!=name for name, field in fields.items()):
+        logger.warning("Correspondence index has legacy text mappings %s - rebuild it to restore keyword fields", fields)
+    _mail_fields.update(checked=time.time(), fields=fields)
+    return fields
+def _mail_filter(fields: dict, name: str, values: list) -> dict:
+    if fields[name]: return {"terms":{fields[name]: values}}
+    # No exact-match field at all: the analysed tokens of a UUID still match as a phrase
+    return {"bool":{"should":[{"match_phrase":{name: v}} for v in values],"minimum_should_match":1}}
+def _federated_facets(fields: dict) -> dict:
+    facets={"sources":{"terms":{"field":"_index"}}}
+    if fields["case_id"]: facets["cases"]={"terms":{"field":fields["case_id"],"size":20}}
+    if fields["thread_id"]: facets["threads"]={"terms":{"field":fields["thread_id"],"size":20}}
+    return facets
+def _scope_sources(res: dict):
+    """Key the "sources" facet by scope ("documents"/"correspondence") rather than physical index"""
+    agg=res.get("aggregations",{}).get("sources")
+    if not agg: return
+    counts={}
+    for b in agg.get("buckets",[]):
+        scope="correspondence" if b["key"] == settings.CORRESPONDENCE_INDEX else "documents"
+        counts[scope]=counts.get(scope,0)+b["doc_count"]
+    agg["buckets"]=[{"key": k, "doc_count": n} for k, n in sorted(counts.items(), key=lambda kv: -kv[1])]
+def search_all(query: str, case_ids: list, size: int=25, offset: int=0, case_id: str|None=None,
+               thread_id: str|None=None, path_prefix: str|None=None, sources: tuple=("documents","correspondence")):
+    """
+    Federated search over documents and PST correspondence in one multi-index request
+
+    Emails are limited to case_ids (the cases the caller can see); filtering by
+    case_id or thread_id returns emails only. dfs_query_then_fetch scores both
+    indices with shared term statistics so their hits rank on one scale.
+    Returns the raw response, with "sources" (keyed by scope, as in the
+    sources argument), "cases" and "threads" facets.
+    """
+    indices=[]; scopes=[]
+    if "documents" in sources and not (case_id or thread_id):
+        # _index holds the physical name (documents_vN) when searching through the alias
+        doc_filter=[{"bool":{"should":[{"term":{"_index":settings.OPENSEARCH_INDEX}},
+                                       {"prefix":{"_index":f"{settings.OPENSEARCH_INDEX}_v"}}],"minimum_should_match":1}}]
+        if path_prefix: doc_filter.append({"prefix":{"path": path_prefix}})
+        indices.append(settings.OPENSEARCH_INDEX); scopes.append({"bool":{"filter":doc_filter}})
+    fields=_correspondence_fields()
+    if "correspondence" in sources and case_ids:
+        mail_filter=[{"term":{"_index":settings.CORRESPONDENCE_INDEX}},_mail_filter(fields,"case_id",[str(c) for c in case_ids])]
+        if case_id: mail_filter.append(_mail_filter(fields,"case_id",[case_id]))
+        if thread_id: mail_filter.append(_mail_filter(fields,"thread_id",[thread_id]))
+        indices.append(settings.CORRESPONDENCE_INDEX); scopes.append({"bool":{"filter":mail_filter}})
+    if not indices:
+        return {"hits":{"total":{"value":0},"hits":[]},"aggregations":{}}
+    cached, cache_key = search_cache.lookup("federated", indices, query, {
+        "size": size, "offset": offset, "case_id": case_id, "thread_id": thread_id, "path_prefix": path_prefix},
+        scope=[str(c) for c in case_ids])
+    if cached is not None: return cached
+    def body(highlight: bool) -> dict:
+        dsl={
+            "from": offset,
+            "size": size,
+            "query": {"bool": {"must": [_text_query(query, highlight, DOCUMENT_FIELDS+EMAIL_FIELDS)],
+                               "filter": [{"bool": {"should": scopes, "minimum_should_match": 1}}]}},
+            "_source": {"excludes": ["text","chunks","content"]}
+        }
+        if highlight:
+            dsl["highlight"]={"fields":{"text":{"fragment_size":200,"number_of_fragments":3},
+                                        "content":{"fragment_size":200,"number_of_fragments":3}},
+                              "max_analyzed_offset":1000000}
+            dsl["aggs"]=_federated_facets(fields)
+        return dsl
+    params=dict(index=",".join(indices), search_type="dfs_query_then_fetch", ignore_unavailable=True)
+    try:
+        res=client().search(body=body(True), **params)
+    except Exception as e:
+        logger.warning("Federated search failed, retrying without highlights or facets: %s", e)
+        return client().search(body=body(False), **params)
+    _scope_sources(res)
+    search_cache.store(cache_key, res)
+    return res
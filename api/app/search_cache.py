@@ -0,0 +1,109 @@
+"""
+Redis cache for search results
+
+Entries are keyed by the normalised query, its filters, the caller's scope
+and the current generation of every index searched. Anything that changes
+an index (API, worker or PST processor) calls bump_generation(), so stale
+entries are simply never looked up again and age out via their TTL.
+
+Indexed documents only become visible after the next refresh, so results
+computed within SEARCH_CACHE_SETTLE_SECONDS of a bump are not cached -
+otherwise a search racing the refresh would pin the pre-update results.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from typing import Iterable, Optional
+
+import redis
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "vericase:search:gen:{index}"
+STATS_KEY = "vericase:search:cache:stats"
+_ENTRY_PREFIX = "vericase:search:cache:"
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_redis = None
+
+
+def _client():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis
+
+
+def normalize_query(query: str) -> str:
+    return _WHITESPACE_RE.sub(" ", query or "").strip().casefold()
+
+
+def bump_generation(index: str):
+    """Invalidate cached results for an index (call after any write to it)"""
+    try:
+        key = GENERATION_KEY.format(index=index)
+        pipe = _client().pipeline()
+        pipe.hincrby(key, "gen", 1)
+        pipe.hset(key, "ts", time.time())
+        pipe.execute()
+    except redis.RedisError:
+        logger.debug("Could not bump search generation for %s", index, exc_info=True)
+
+
+def _generations(indices: Iterable[str]):
+    pipe = _client().pipeline()
+    for index in indices:
+        pipe.hmget(GENERATION_KEY.format(index=index), "gen", "ts")
+    return [(int(gen or 0), float(ts or 0)) for gen, ts in pipe.execute()]
+
+
+def lookup(kind: str, indices: Iterable[str], query: str, params: dict, scope: Optional[list] = None):
+    """
+    Return (cached result or None, key to store under or None)
+
+    The key is None when caching is disabled or Redis is unavailable, or when
+    an index changed too recently for its results to be cached.
+    """
+    if not settings.SEARCH_CACHE_ENABLED:
+        return None, None
+    indices = sorted(indices)
+    try:
+        generations = _generations(indices)
+        raw = json.dumps({
+            "kind": kind, "q": normalize_query(query), "params": params,
+            "scope": sorted(scope) if scope is not None else None,
+            "gen": [gen for gen, _ in generations],
+        }, sort_keys=True, default=str)
+        key = _ENTRY_PREFIX + hashlib.sha256(raw.encode()).hexdigest()
+        cached = _client().get(key)
+        _client().hincrby(STATS_KEY, "hits" if cached is not None else "misses", 1)
+        if cached is not None:
+            return json.loads(cached), None
+        settling = any(time.time() - ts < settings.SEARCH_CACHE_SETTLE_SECONDS for _, ts in generations)
+        return None, (None if settling else key)
+    except (redis.RedisError, ValueError):
+        logger.debug("Search cache lookup failed", exc_info=True)
+        return None, None
+
+
+def store(key: Optional[str], result: dict):
+    if not key:
+        return
+    try:
+        _client().set(key, json.dumps(result, default=str), ex=settings.SEARCH_CACHE_TTL)
+    except redis.RedisError:
+        logger.debug("Search cache store failed", exc_info=True)
+
+
+def stats() -> dict:
+    try:
+        raw = _client().hgetall(STATS_KEY)
+    except redis.RedisError:
+        return {"hits": 0, "misses": 0, "hit_rate": None, "available": False}
+    hits = int(raw.get(b"hits", 0)); misses = int(raw.get(b"misses", 0))
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            "available": True}
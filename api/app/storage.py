@@ -1,8 +1,14 @@
 import boto3
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from botocore.client import Config
 from botocore.exceptions import ClientError
 from .config import settings
 import time
+
+logger = logging.getLogger(__name__)
 _s3=None
 _s3_pub=None
 def s3(public: bool=False):
@@ -118,3 +124,94 @@ def delete_object(key: str):
         code = exc.response.get("Error", {}).get("Code")
         if code not in {"NoSuchKey", "404"}:
             raise
+
+
+def download_file_parallel(client, bucket: str, key: str, dest_path: str, part_size: int = 64 * 1024 * 1024,
+                           concurrency: int = 16, verify: bool = True) -> int:
+    """
+    Download an object with concurrent ranged GETs into a preallocated file
+
+    Each range is streamed straight to its offset with pwrite, so memory use
+    is one read chunk per thread regardless of object size. With verify, the
+    local file is checked against x-amz-meta-sha256 when present, otherwise
+    against the ETag (plain MD5, or MD5-of-part-MD5s for multipart uploads).
+    Returns the number of bytes downloaded.
+    """
+    head = client.head_object(Bucket=bucket, Key=key)
+    size = head["ContentLength"]
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+    fd = os.open(dest_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        os.ftruncate(fd, size)
+        if hasattr(os, "posix_fallocate") and size:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                pass  # Not supported by every filesystem; ftruncate is enough
+
+        def fetch(byte_range):
+            start, end = byte_range
+            body = client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}",
+                                     IfMatch=head["ETag"])["Body"]
+            offset = start
+            for chunk in body.iter_chunks(chunk_size=1024 * 1024):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+            if offset != end + 1:
+                raise IOError(f"Short read for s3://{bucket}/{key} bytes {start}-{end}")
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            list(pool.map(fetch, ranges))
+    finally:
+        os.close(fd)
+
+    if verify:
+        _verify_download(client, bucket, key, dest_path, head, concurrency)
+    return size
+
+
+def _hash_range(path: str, start: int, length: int, algorithm: str) -> bytes:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(8 * 1024 * 1024, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.digest()
+
+
+def _verify_download(client, bucket: str, key: str, path: str, head: dict, concurrency: int):
+    size = head["ContentLength"]
+    expected_sha256 = (head.get("Metadata") or {}).get("sha256")
+    if expected_sha256:
+        actual = _hash_range(path, 0, size, "sha256").hex()
+        if actual != expected_sha256.lower():
+            raise ValueError(f"SHA-256 mismatch for s3://{bucket}/{key}")
+        return
+
+    # With SSE-KMS or SSE-C the ETag is not an MD5 of the content
+    if head.get("ServerSideEncryption") == "aws:kms" or head.get("SSECustomerAlgorithm"):
+        logger.info("Not verifying s3://%s/%s: encrypted with SSE-KMS/SSE-C and no sha256 metadata", bucket, key)
+        return
+
+    etag = head.get("ETag", "").strip('"')
+    if "-" not in etag:
+        if _hash_range(path, 0, size, "md5").hex() != etag:
+            raise ValueError(f"ETag (MD5) mismatch for s3://{bucket}/{key}")
+        return
+
+    # Multipart ETag: MD5 of the concatenated part MD5s. The first part's size
+    # gives the part size the object was uploaded with.
+    part_count = int(etag.split("-")[1])
+    upload_part_size = client.head_object(Bucket=bucket, Key=key, PartNumber=1)["ContentLength"]
+    offsets = range(0, size, upload_part_size)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        digests = list(pool.map(lambda start: _hash_range(path, start, upload_part_size, "md5"), offsets))
+    if len(digests) != part_count or hashlib.md5(b"".join(digests)).hexdigest() != etag.split("-")[0]:
+        raise ValueError(f"Multipart ETag mismatch for s3://{bucket}/{key}")
+    logger.debug("Verified s3://%s/%s against multipart ETag (%d parts)", bucket, key, part_count)
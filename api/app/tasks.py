@@ -1,3 +1,26 @@
+import os
 from celery import Celery
 from .config import settings
 celery_app = Celery("vericase-docs", broker=settings.REDIS_URL, backend=settings.REDIS_URL)
+
+# Types that always go through OCR, however small
+_IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".gif", ".webp"}
+
+def extraction_queue(filename: str, content_type: str|None, size: int) -> str:
+    """
+    Pick the worker queue for a newly uploaded file
+
+    PSTs get their own queue so a multi-GB mailbox never blocks interactive
+    uploads. Images, large PDFs (likely scans) and anything big go to the
+    heavy OCR queue; everything else is text extraction on the fast queue.
+    Unknown sizes (0) are treated as large.
+    """
+    ext = os.path.splitext((filename or "").lower())[1]
+    ct = (content_type or "").lower()
+    if ext == ".pst":
+        return settings.CELERY_PST_QUEUE
+    if ext in _IMAGE_EXTENSIONS or ct.startswith("image/"):
+        return settings.CELERY_QUEUE
+    if ext == ".pdf" or ct == "application/pdf":
+        return settings.CELERY_FAST_QUEUE if 0 < size <= settings.FAST_QUEUE_MAX_PDF_BYTES else settings.CELERY_QUEUE
+    return settings.CELERY_FAST_QUEUE if 0 < size <= settings.FAST_QUEUE_MAX_BYTES else settings.CELERY_QUEUE
@@ -0,0 +1,15 @@
+-- Migration: Content-addressed attachment store
+-- Date: 2026-10-18
+-- Description: One row per unique attachment (SHA-256) per company or case,
+-- so identical attachments across PST imports are uploaded to S3 once
+
+CREATE TABLE IF NOT EXISTS attachment_blobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    scope VARCHAR(100) NOT NULL, -- company:<id> or case:<id>
+    sha256 VARCHAR(64) NOT NULL,
+    document_id UUID NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    s3_key VARCHAR(2048) NOT NULL,
+    size BIGINT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    CONSTRAINT uq_attachment_blobs_scope_sha256 UNIQUE (scope, sha256)
+);
@@ -0,0 +1,14 @@
+-- Migration: Persisted email thread lookups
+-- Date: 2026-10-18
+-- Description: Message-ID / conversation root / subject -> thread_id per case,
+-- so each PST import threads only its own emails
+
+CREATE TABLE IF NOT EXISTS email_thread_keys (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    case_id UUID NOT NULL REFERENCES cases(id) ON DELETE CASCADE,
+    key_type VARCHAR(20) NOT NULL, -- message, conversation, subject
+    key VARCHAR(500) NOT NULL,
+    thread_id VARCHAR(100) NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    CONSTRAINT uq_email_thread_keys_case_key UNIQUE (case_id, key_type, key)
+);
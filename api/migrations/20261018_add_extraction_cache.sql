@@ -0,0 +1,11 @@
+-- Migration: Extraction cache
+-- Date: 2026-10-18
+-- Description: Tika/OCR output keyed by SHA-256 of the file bytes so the
+-- worker can skip extraction for content it has already seen
+
+CREATE TABLE IF NOT EXISTS extraction_cache (
+    sha256 VARCHAR(64) PRIMARY KEY,
+    text TEXT NOT NULL,
+    method VARCHAR(20), -- tika, ocr
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
@@ -0,0 +1,14 @@
+-- Migration: Share only the S3 object of deduplicated attachments
+-- Date: 2026-10-18
+-- Description: Every PST import now gets its own attachment documents, which
+-- may point at the same content-addressed s3_key. An object is deleted only
+-- once no document references it, so look-ups by s3_key need indexes.
+
+CREATE INDEX IF NOT EXISTS ix_documents_s3_key ON documents (s3_key);
+CREATE INDEX IF NOT EXISTS ix_attachment_blobs_s3_key ON attachment_blobs (s3_key);
+
+-- Tables created by the ORM at startup, before 20261018_add_attachment_blobs.sql
+-- ran, lack ON DELETE CASCADE
+ALTER TABLE attachment_blobs DROP CONSTRAINT IF EXISTS attachment_blobs_document_id_fkey;
+ALTER TABLE attachment_blobs ADD CONSTRAINT attachment_blobs_document_id_fkey
+    FOREIGN KEY (document_id) REFERENCES documents(id) ON DELETE CASCADE;
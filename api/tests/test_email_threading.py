@@ -0,0 +1,103 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.email_threading import EmailThreader, normalize_subject, thread_id_for_message  # noqa: E402
+
+
+BASE_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _row(row_id, message_id=None, in_reply_to=None, references=None, conversation_index=None,
+         subject=None, minutes=0, thread_id=None):
+    return {
+        "id": row_id,
+        "message_id": message_id,
+        "in_reply_to": in_reply_to,
+        "references": references,
+        "conversation_index": conversation_index,
+        "subject": subject,
+        "date": BASE_DATE + timedelta(minutes=minutes),
+        "thread_id": thread_id,
+    }
+
+
+def test_normalize_subject_strips_reply_prefixes():
+    assert normalize_subject("RE: Fwd:  Notice of   Delay") == "notice of delay"
+    assert normalize_subject("Re[2]: AW: Notice of Delay") == "notice of delay"
+    # Prefixes are only stripped from the start of the subject
+    assert normalize_subject("Programme re: sequencing") == "programme re: sequencing"
+
+
+def test_reply_chain_and_references_share_one_thread():
+    rows = [
+        _row(3, "c@x", references="<a@x> <b@x>", subject="RE: RE: Variation", minutes=20),
+        _row(1, "a@x", subject="Variation", minutes=0),
+        _row(2, "b@x", in_reply_to="a@x", subject="RE: Variation", minutes=10),
+    ]
+    assignments = EmailThreader().assign(rows)
+    assert set(assignments.values()) == {thread_id_for_message("a@x")}
+    assert len(assignments) == 3
+
+
+def test_conversation_index_and_subject_fallback():
+    conv = "01d2a3b4c5d6e7f8a9b0c1"
+    rows = [
+        _row(1, "a@x", conversation_index=conv + "0000", subject="Site access", minutes=0),
+        _row(2, "b@x", conversation_index=conv + "1111", subject="Other", minutes=5),
+        _row(3, "c@x", subject="RE: Site access", minutes=10),
+        _row(4, "d@x", subject="Unrelated", minutes=15),
+    ]
+    assignments = EmailThreader().assign(rows)
+    assert assignments[1] == assignments[2] == assignments[3]
+    assert assignments[4] == thread_id_for_message("d@x")
+
+
+def test_existing_threads_are_kept_and_extended():
+    rows = [
+        _row(1, "a@x", subject="EOT claim", thread_id="thread_existing"),
+        _row(2, "b@x", in_reply_to="<a@x>", subject="RE: EOT claim", minutes=5),
+    ]
+    assignments = EmailThreader().assign(rows)
+    assert assignments == {2: "thread_existing"}
+
+
+def test_incremental_import_merges_with_stored_keys():
+    first = EmailThreader()
+    first_assignments = first.assign([
+        _row(1, "b@x", in_reply_to="a@x", subject="RE: Payment notice", minutes=10),
+    ])
+
+    # Second import only sees its own rows plus the keys persisted by the first
+    second = EmailThreader()
+    for (key_type, key), thread_id in first.new_keys.items():
+        second.load(key_type, key, thread_id)
+    second_assignments = second.assign([
+        _row(2, "a@x", subject="Payment notice", minutes=0),
+        _row(3, "c@x", in_reply_to="b@x", subject="RE: RE: Payment notice", minutes=20),
+    ])
+
+    assert second_assignments == {2: first_assignments[1], 3: first_assignments[1]}
+    assert not any(key == ("message", "b@x") for key in second.new_keys)
+
+
+def test_replies_to_missing_parent_thread_the_same_in_one_or_two_imports():
+    replies = [
+        _row(1, "b@x", in_reply_to="a@x", subject="RE: Site access", minutes=10),
+        _row(2, "c@x", in_reply_to="a@x", subject="RE: Site access - revised", minutes=20),
+    ]
+    together = EmailThreader().assign(replies)
+
+    first = EmailThreader()
+    split = first.assign(replies[:1])
+    second = EmailThreader()
+    for (key_type, key), thread_id in first.new_keys.items():
+        second.load(key_type, key, thread_id)
+    split.update(second.assign(replies[1:]))
+
+    assert together[1] == together[2]
+    assert split == together
@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.config import settings  # noqa: E402
+from app.tasks import extraction_queue  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def test_psts_go_to_their_own_queue_whatever_the_size():
+    assert extraction_queue("Mailbox.PST", "application/octet-stream", 10) == settings.CELERY_PST_QUEUE
+    assert extraction_queue("archive.pst", None, 0) == settings.CELERY_PST_QUEUE
+
+
+def test_images_always_go_to_ocr():
+    assert extraction_queue("site-photo.JPG", None, 1024) == settings.CELERY_QUEUE
+    assert extraction_queue("scan", "image/tiff", 1024) == settings.CELERY_QUEUE
+
+
+def test_pdfs_split_on_the_pdf_threshold(monkeypatch):
+    monkeypatch.setattr(settings, "FAST_QUEUE_MAX_PDF_BYTES", 2 * MB)
+    assert extraction_queue("letter.pdf", None, 2 * MB) == settings.CELERY_FAST_QUEUE
+    assert extraction_queue("drawing.pdf", None, 2 * MB + 1) == settings.CELERY_QUEUE
+    assert extraction_queue("download", "application/pdf", 100) == settings.CELERY_FAST_QUEUE
+
+
+def test_other_files_split_on_the_general_threshold(monkeypatch):
+    monkeypatch.setattr(settings, "FAST_QUEUE_MAX_BYTES", 25 * MB)
+    assert extraction_queue("minutes.docx", None, 25 * MB) == settings.CELERY_FAST_QUEUE
+    assert extraction_queue("export.csv", "text/csv", 25 * MB + 1) == settings.CELERY_QUEUE
+
+
+def test_unknown_size_is_treated_as_large():
+    assert extraction_queue("letter.pdf", None, 0) == settings.CELERY_QUEUE
+    assert extraction_queue("notes.txt", "text/plain", 0) == settings.CELERY_QUEUE
@@ -0,0 +1,25 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.reindex import rebuild_source  # noqa: E402
+
+
+def test_rebuild_prefers_cached_extraction():
+    src = {"id": "1", "path": "/Contracts/2024", "content_sha256": "abc",
+           "chunks": [{"ordinal": 0, "page": 1, "text": "stale"}]}
+    doc = rebuild_source(src, {"abc": "fresh text"})
+    assert [c["text"] for c in doc["chunks"]] == ["fresh text"]
+    assert doc["path_root"] == "Contracts"
+    assert src["chunks"][0]["text"] == "stale"  # source hit left untouched
+
+
+def test_rebuild_chunks_legacy_text_and_keeps_existing_chunks():
+    legacy = rebuild_source({"id": "2", "text": "old unchunked body"}, {})
+    assert "text" not in legacy and legacy["chunks"][0]["text"] == "old unchunked body"
+
+    chunks = [{"ordinal": 0, "page": 1, "text": "kept"}]
+    assert rebuild_source({"id": "3", "chunks": chunks, "content_sha256": "missing"}, {})["chunks"] == chunks
@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.search import chunk_text, hit_snippets  # noqa: E402
+
+
+def test_chunks_cover_text_with_overlap_and_pages():
+    text = "alpha beta gamma delta " * 20 + "\f" + "epsilon zeta eta theta " * 20
+    chunks = chunk_text(text, size=100, overlap=20, max_chunks=1000)
+
+    assert [c["ordinal"] for c in chunks] == list(range(len(chunks)))
+    assert all(len(c["text"]) <= 100 for c in chunks)
+    assert chunks[0]["page"] == 1 and chunks[-1]["page"] == 2
+    # Every word of the document lands in some chunk
+    joined = " ".join(c["text"] for c in chunks)
+    assert "theta" in joined and "alpha" in joined
+
+
+def test_chunk_size_grows_to_respect_max_chunks():
+    text = "word " * 10000
+    assert len(chunk_text(text, size=100, overlap=20, max_chunks=10)) <= 10
+    assert chunk_text("   ") == []
+
+
+def test_hit_snippets_merges_parent_and_chunk_highlights():
+    hit = {
+        "highlight": {"text": ["legacy <em>delay</em>"]},
+        "inner_hits": {"chunks": {"hits": {"hits": [
+            {"_source": {"page": 7}, "highlight": {"chunks.text": ["notice of <em>delay</em>"]}},
+            {"_source": {"page": 2}, "highlight": {"chunks.text": ["<em>delay</em> event"]}},
+        ]}}},
+    }
+    fragments, pages = hit_snippets(hit)
+    assert fragments == ["legacy <em>delay</em>", "notice of <em>delay</em>", "<em>delay</em> event"]
+    assert pages == [2, 7]
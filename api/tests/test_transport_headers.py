@@ -0,0 +1,30 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.pst_processor import parse_transport_headers  # noqa: E402
+
+
+def test_folded_headers_are_unfolded():
+    raw = ("Message-ID: <c@x>\r\n"
+           "References: <a@x>\r\n"
+           " <b@x>\r\n"
+           "\t<c0@x>\r\n"
+           "Subject: Notice of\r\n"
+           "  delay\r\n")
+    headers = parse_transport_headers(raw)
+    assert headers["references"] == "<a@x> <b@x> <c0@x>"
+    assert headers["subject"] == "Notice of delay"
+
+
+def test_names_are_case_insensitive_and_first_occurrence_wins():
+    raw = "IN-REPLY-TO: <a@x>\nIn-Reply-To: <b@x>\nthread-topic: Variation 12\n"
+    assert parse_transport_headers(raw) == {"in-reply-to": "<a@x>", "thread-topic": "Variation 12"}
+
+
+def test_parsing_stops_at_the_blank_line():
+    raw = "Message-ID: <a@x>\n\nIn-Reply-To: <body@x>\nnot a header\n"
+    assert parse_transport_headers(raw) == {"message-id": "<a@x>"}
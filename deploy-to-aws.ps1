@@ -31,11 +31,10 @@ Write-Host ""
 
 # Step 3: Build and push Worker image
 Write-Host "Step 3: Building and pushing Worker image..." -ForegroundColor Cyan
-Push-Location worker
-docker build -t vericase-worker:latest .
+# Built from the repository root so the image ships the API package it imports
+docker build -f worker/Dockerfile -t vericase-worker:latest .
 docker tag vericase-worker:latest "$ECR_WORKER_REPO:latest"
 docker push "$ECR_WORKER_REPO:latest"
-Pop-Location
 Write-Host "✓ Worker image pushed successfully" -ForegroundColor Green
 Write-Host ""
 
@@ -31,11 +31,10 @@ echo ""
 
 # Step 3: Build and push Worker image
 echo "Step 3: Building and pushing Worker image..."
-cd worker
-docker build -t vericase-worker:latest .
+# Built from the repository root so the image ships the API package it imports
+docker build -f worker/Dockerfile -t vericase-worker:latest .
 docker tag vericase-worker:latest ${ECR_WORKER_REPO}:latest
 docker push ${ECR_WORKER_REPO}:latest
-cd ..
 echo "✓ Worker image pushed successfully"
 echo ""
 
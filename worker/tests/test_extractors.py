@@ -0,0 +1,55 @@
+import sys
+import zipfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from worker_app import extractors  # noqa: E402
+
+
+def _write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_plain_text_falls_back_to_cp1252(tmp_path):
+    path = _write(tmp_path, "notes.txt", "Clause 2.3 – “delay”".encode("cp1252"))
+    assert extractors.extract(path, "notes.txt") == "Clause 2.3 – “delay”"
+
+
+def test_json_indexes_values_not_keys(tmp_path):
+    path = _write(tmp_path, "export.json", b'{"subject": "Variation 12", "items": [{"cost": 1500}, null]}')
+    assert extractors.extract(path, "export.json") == "Variation 12\n1500"
+
+
+def test_content_type_picks_the_extractor_without_an_extension(tmp_path):
+    eml = (b"From: site@example.com\r\nSubject: Notice of delay\r\nContent-Type: text/html\r\n\r\n"
+           b"<html><style>p {}</style><p>Works stopped &amp; resumed</p></html>")
+    path = _write(tmp_path, "upload", eml)
+    text = extractors.extract(path, "upload", "message/rfc822; charset=utf-8")
+    assert text.startswith("From: site@example.com\nSubject: Notice of delay\n\n")
+    assert "Works stopped & resumed" in text and "p {}" not in text
+
+
+def test_docx_paragraphs_tabs_and_breaks(tmp_path):
+    w = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+    document = (f'<w:document xmlns:w="{w}"><w:body>'
+                '<w:p><w:r><w:t>Item</w:t><w:tab/><w:t>Cost</w:t></w:r></w:p>'
+                '<w:p><w:r><w:t>Line one</w:t><w:br/><w:t>Line two</w:t></w:r></w:p>'
+                '</w:body></w:document>')
+    path = tmp_path / "minutes.docx"
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("word/document.xml", document)
+    assert extractors.extract(str(path), "minutes.docx") == "Item\tCost\nLine one\nLine two"
+
+
+def test_unknown_broken_or_oversized_files_return_empty(tmp_path, monkeypatch):
+    assert extractors.extract(_write(tmp_path, "drawing.dwg", b"AC1032"), "drawing.dwg", "image/vnd.dwg") == ""
+    assert extractors.extract(_write(tmp_path, "broken.docx", b"not a zip"), "broken.docx") == ""
+
+    path = _write(tmp_path, "big.txt", b"x" * 11)
+    monkeypatch.setattr(extractors.settings, "NATIVE_EXTRACT_MAX_BYTES", 10)
+    assert extractors.extract(path, "big.txt") == ""
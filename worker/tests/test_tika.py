@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+for path in (ROOT, ROOT.parent / "api"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+
+class _StandInTika(BaseHTTPRequestHandler):
+    """Answers PUT /tika like Tika's text endpoint; the first `busy` requests get a 503"""
+    busy = 0
+    requests = []
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        type(self).requests.append({"path": self.path, "accept": self.headers.get("Accept"), "body": body})
+        if type(self).busy:
+            type(self).busy -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        text = b"extracted: " + body
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, *args):
+        pass
+
+
+SERVER = ThreadingHTTPServer(("127.0.0.1", 0), _StandInTika)
+threading.Thread(target=SERVER.serve_forever, daemon=True).start()
+# Read by worker_app.config at import time
+os.environ.update({"TIKA_URL": f"http://127.0.0.1:{SERVER.server_address[1]}", "TIKA_RETRY_BACKOFF": "0",
+                   "TIKA_MAX_CONCURRENCY": "0", "WORKER_METRICS_PORT": "0"})
+
+from worker_app import worker  # noqa: E402
+
+
+class _FullSlots:
+    """Redis stand-in whose Tika semaphore never has a free slot"""
+    def pipeline(self):
+        return self
+
+    def zremrangebyscore(self, *args):
+        pass
+
+    def zadd(self, *args):
+        pass
+
+    def zrank(self, *args):
+        pass
+
+    def execute(self):
+        return [0, 1, worker.settings.TIKA_MAX_CONCURRENCY]
+
+    def zrem(self, *args):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def _reset_server():
+    _StandInTika.busy = 0
+    _StandInTika.requests = []
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / "notice.rtf"
+    path.write_bytes(b"Notice of delay to practical completion")
+    return str(path)
+
+
+def test_tika_extract_streams_the_file(document):
+    assert worker._tika_extract(document) == "extracted: Notice of delay to practical completion"
+    assert _StandInTika.requests == [{"path": "/tika", "accept": "text/plain",
+                                      "body": b"Notice of delay to practical completion"}]
+
+
+def test_tika_503_is_retried_with_the_whole_body(document):
+    _StandInTika.busy = 2
+    assert worker._tika_extract(document).startswith("extracted: Notice")
+    assert len(_StandInTika.requests) == 3
+    assert {r["body"] for r in _StandInTika.requests} == {b"Notice of delay to practical completion"}
+
+
+def test_full_semaphore_raises_instead_of_calling_tika(document, monkeypatch):
+    monkeypatch.setattr(worker.settings, "TIKA_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(worker.settings, "TIKA_ACQUIRE_TIMEOUT", 0)
+    monkeypatch.setattr(worker, "redis_client", _FullSlots())
+
+    with pytest.raises(worker.TikaBusy):
+        worker._tika_extract(document)
+    assert _StandInTika.requests == []
@@ -19,9 +19,43 @@ class Settings:
     OPENSEARCH_USE_SSL = os.getenv("OPENSEARCH_USE_SSL","false").lower() == "true"
     OPENSEARCH_VERIFY_CERTS = os.getenv("OPENSEARCH_VERIFY_CERTS","false").lower() == "true"
     OPENSEARCH_INDEX = os.getenv("OPENSEARCH_INDEX","documents")
+    # Refresh policy for indexed documents: none (index refresh_interval), wait_for, or periodic
+    OPENSEARCH_REFRESH = os.getenv("OPENSEARCH_REFRESH","none").lower()
+    OPENSEARCH_REFRESH_PERIOD = float(os.getenv("OPENSEARCH_REFRESH_PERIOD","5"))  # Seconds between periodic refreshes
+    # Buffer finished documents for this many seconds and index them with one _bulk call (0 = index immediately)
+    INDEX_BUFFER_WINDOW = float(os.getenv("INDEX_BUFFER_WINDOW","2"))
+    INDEX_BUFFER_MAX_DOCS = int(os.getenv("INDEX_BUFFER_MAX_DOCS","500"))
+    INDEX_BUFFER_RETRY_DELAY = float(os.getenv("INDEX_BUFFER_RETRY_DELAY","10"))  # Seconds before re-flushing after a failed _bulk
+    INDEX_BUFFER_MAX_ATTEMPTS = int(os.getenv("INDEX_BUFFER_MAX_ATTEMPTS","5"))  # Then the document is marked FAILED
     
     # Other services
     REDIS_URL = os.getenv("REDIS_URL","redis://redis:6379/0")
-    CELERY_QUEUE = os.getenv("CELERY_QUEUE","ocr")
+    CELERY_QUEUE = os.getenv("CELERY_QUEUE","ocr")  # Heavy OCR queue
+    CELERY_FAST_QUEUE = os.getenv("CELERY_FAST_QUEUE","fast")  # Small text files and index housekeeping
+    CELERY_PST_QUEUE = os.getenv("CELERY_PST_QUEUE","pst")
+    # Tasks each worker process reserves ahead; keep 1 for long OCR/PST jobs, raise for the fast queue
+    CELERY_PREFETCH_MULTIPLIER = int(os.getenv("CELERY_PREFETCH_MULTIPLIER","1"))
+    # Unacked (acks_late) tasks are redelivered after this long - must exceed the longest PST run
+    CELERY_VISIBILITY_TIMEOUT = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", str(12*3600)))
     TIKA_URL = os.getenv("TIKA_URL","http://tika:9998")
+    TIKA_MAX_CONCURRENCY = int(os.getenv("TIKA_MAX_CONCURRENCY","8"))  # Concurrent Tika requests across all workers (0 = unlimited)
+    TIKA_ACQUIRE_TIMEOUT = float(os.getenv("TIKA_ACQUIRE_TIMEOUT","120"))  # Max seconds to wait for a free slot
+    TIKA_BUSY_RETRY_DELAY = float(os.getenv("TIKA_BUSY_RETRY_DELAY","60"))  # Then the task is re-queued after ~this long
+    TIKA_BUSY_MAX_RETRIES = int(os.getenv("TIKA_BUSY_MAX_RETRIES","10"))
+    TIKA_TIMEOUT = float(os.getenv("TIKA_TIMEOUT","60"))  # Read timeout per request
+    TIKA_RETRIES = int(os.getenv("TIKA_RETRIES","3"))  # Retries on 503 / connection errors
+    TIKA_RETRY_BACKOFF = float(os.getenv("TIKA_RETRY_BACKOFF","1"))
+    # In-process extraction (txt/csv/json/eml/docx/text-layer PDF) before falling back to Tika
+    NATIVE_EXTRACT_MAX_BYTES = int(os.getenv("NATIVE_EXTRACT_MAX_BYTES", str(100*1024*1024)))
+    NATIVE_PDF_MIN_PAGE_CHARS = int(os.getenv("NATIVE_PDF_MIN_PAGE_CHARS","50"))  # PDF pages with less text are OCR'd
+    WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT","9808"))  # Prometheus /metrics on the worker (0 = off)
+    WORKER_SCRATCH_DIR = os.getenv("WORKER_SCRATCH_DIR","")  # Spool dir for downloaded files; empty = system temp
+    
+    # OCR - PDFs longer than OCR_PAGES_PER_SHARD are split and OCR'd in parallel
+    OCR_PARALLELISM = int(os.getenv("OCR_PARALLELISM", str(os.cpu_count() or 1)))
+    OCR_PAGES_PER_SHARD = int(os.getenv("OCR_PAGES_PER_SHARD","50"))
+    
+    # PST processing - split large PSTs across worker processes when > 1
+    PST_PARALLEL_PARTITIONS = int(os.getenv("PST_PARALLEL_PARTITIONS","1"))
+    PST_PARTITION_MIN_MESSAGES = int(os.getenv("PST_PARTITION_MIN_MESSAGES","5000"))
 settings = Settings()
@@ -0,0 +1,100 @@
+"""
+In-process text extractors for common formats
+
+Tika is a network hop plus (de)serialisation for every file; plain text,
+CSV, JSON, email and DOCX are cheap to handle here instead. extract()
+returns "" when no native extractor applies or it can't produce usable
+text, and the caller falls back to Tika. PDFs are read page by page with
+pdf_page_texts() so the caller can OCR just the image-only pages.
+"""
+import json, os, re, subprocess, zipfile
+from email import policy
+from email.parser import BytesParser
+from html import unescape
+from xml.etree import ElementTree
+from .config import settings
+
+_EXTRACTORS = {}
+# Uploads without a useful extension still carry a content type
+_CONTENT_TYPES = {
+    "text/plain": ".txt", "text/csv": ".csv", "application/json": ".json", "message/rfc822": ".eml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+}
+
+def extractor(*extensions):
+    def register(fn):
+        for ext in extensions: _EXTRACTORS[ext] = fn
+        return fn
+    return register
+
+def extract(path: str, filename: str, content_type: str|None=None) -> str:
+    ext = os.path.splitext((filename or "").lower())[1]
+    fn = _EXTRACTORS.get(ext) or _EXTRACTORS.get(_CONTENT_TYPES.get((content_type or "").split(";")[0].strip().lower(), ""))
+    if not fn or os.path.getsize(path) > settings.NATIVE_EXTRACT_MAX_BYTES: return ""
+    try: return fn(path) or ""
+    except Exception: return ""
+
+def _decode(data: bytes) -> str:
+    for encoding in ("utf-8-sig", "cp1252"):
+        try: return data.decode(encoding)
+        except UnicodeDecodeError: pass
+    return data.decode("latin-1")
+
+@extractor(".txt", ".text", ".csv", ".tsv", ".log", ".md")
+def _plain(path: str) -> str:
+    with open(path, "rb") as f: return _decode(f.read())
+
+@extractor(".json")
+def _json(path: str) -> str:
+    with open(path, "rb") as f: raw = _decode(f.read())
+    try: data = json.loads(raw)
+    except ValueError: return raw
+    # Index the values, not the punctuation
+    values = []
+    def walk(node):
+        if isinstance(node, dict):
+            for v in node.values(): walk(v)
+        elif isinstance(node, list):
+            for v in node: walk(v)
+        elif node is not None:
+            values.append(str(node))
+    walk(data)
+    return "\n".join(values)
+
+_TAG_RE = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.IGNORECASE | re.DOTALL)
+
+@extractor(".eml")
+def _eml(path: str) -> str:
+    with open(path, "rb") as f: msg = BytesParser(policy=policy.default).parse(f)
+    headers = [f"{h}: {msg[h]}" for h in ("From", "To", "Cc", "Date", "Subject") if msg[h]]
+    body = msg.get_body(preferencelist=("plain", "html"))
+    content = body.get_content() if body else ""
+    if body is not None and body.get_content_type() == "text/html":
+        content = unescape(_TAG_RE.sub(" ", content))
+    return "\n".join(headers) + "\n\n" + content
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+@extractor(".docx")
+def _docx(path: str) -> str:
+    with zipfile.ZipFile(path) as z: root = ElementTree.fromstring(z.read("word/document.xml"))
+    paragraphs = []
+    for p in root.iter(_W + "p"):
+        parts = []
+        for node in p.iter():
+            if node.tag == _W + "t" and node.text: parts.append(node.text)
+            elif node.tag == _W + "tab": parts.append("\t")
+            elif node.tag in (_W + "br", _W + "cr"): parts.append("\n")
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs)
+
+def pdf_page_texts(path: str) -> list|None:
+    """Text layer of each PDF page via pdftotext, or None if it can't be read (damaged/encrypted)"""
+    try:
+        r = subprocess.run(["pdftotext", "-enc", "UTF-8", path, "-"], capture_output=True, timeout=settings.TIKA_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired): return None
+    if r.returncode != 0: return None
+    text = r.stdout.decode("utf-8", errors="ignore")
+    # pdftotext ends every page, including the last, with a form feed
+    if text.endswith("\f"): text = text[:-1]
+    return text.split("\f")
@@ -0,0 +1,80 @@
+"""
+Worker metrics
+
+Stage latencies, bytes, OCR'd pages and extraction-cache results are recorded
+as Prometheus metrics and, for the task in progress, in a per-task summary
+that the task returns. Celery's prefork children each record into
+prometheus_client's multiprocess directory; the parent serves the merged
+view on WORKER_METRICS_PORT.
+"""
+import os, tempfile, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .config import settings
+
+# prometheus_client picks multiprocess mode at import time; each worker pool gets a fresh directory
+if settings.WORKER_METRICS_PORT and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="vericase-metrics-")
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, multiprocess, start_http_server  # noqa: E402
+
+STAGE_SECONDS = Histogram("vericase_worker_stage_seconds", "Time spent in each processing stage", ["stage"],
+                          buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900))
+BYTES = Counter("vericase_worker_bytes_total", "Bytes of source files fetched for extraction")
+OCR_PAGES = Counter("vericase_worker_ocr_pages_total", "Pages sent through OCR")
+CACHE = Counter("vericase_worker_extraction_cache_total", "Extraction cache lookups", ["result"])
+DOCUMENTS = Counter("vericase_worker_documents_total", "Documents extracted, by method", ["method"])
+
+_current = ContextVar("task_metrics", default=None)
+
+class TaskMetrics:
+    """Per-task tallies, returned as the task's metrics summary"""
+    def __init__(self):
+        self.stages_ms = {}; self.bytes = 0; self.ocr_pages = 0; self.cache = None
+    def summary(self) -> dict:
+        return {"stages_ms": {k: round(v, 1) for k, v in self.stages_ms.items()},
+                "bytes": self.bytes, "ocr_pages": self.ocr_pages, "cache": self.cache}
+
+@contextmanager
+def task():
+    m = TaskMetrics(); token = _current.set(m)
+    try: yield m
+    finally: _current.reset(token)
+
+@contextmanager
+def stage(name: str):
+    started = time.monotonic()
+    try: yield
+    finally:
+        elapsed = time.monotonic() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        m = _current.get()
+        if m is not None: m.stages_ms[name] = m.stages_ms.get(name, 0) + elapsed * 1000
+
+def add_bytes(n: int):
+    BYTES.inc(n)
+    m = _current.get()
+    if m is not None: m.bytes += n
+
+def add_ocr_pages(n: int):
+    OCR_PAGES.inc(n)
+    m = _current.get()
+    if m is not None: m.ocr_pages += n
+
+def cache_result(hit: bool):
+    CACHE.labels("hit" if hit else "miss").inc()
+    m = _current.get()
+    if m is not None: m.cache = "hit" if hit else "miss"
+
+def document_extracted(method: str):
+    DOCUMENTS.labels(method).inc()
+
+def start_server():
+    """Serve the metrics of every pool process (call once, from the parent)"""
+    if not settings.WORKER_METRICS_PORT: return
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(settings.WORKER_METRICS_PORT, registry=registry)
+
+def process_exited(pid: int):
+    if settings.WORKER_METRICS_PORT: multiprocess.mark_process_dead(pid)
@@ -1,14 +1,38 @@
-import io, os, tempfile
+import os, sys, random, tempfile, hashlib, json, time, uuid, logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
 import boto3
 from botocore.client import Config
 from sqlalchemy import create_engine, text
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import OpenSearch, RequestsHttpConnection, helpers
+import redis
 import requests, subprocess, pytesseract
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
 from .config import settings
+from . import extractors, metrics
+
+# The image ships the API package at /code/app (see worker/Dockerfile); indexing uses its helpers
+# so documents are chunked, faceted and cache-invalidated exactly the way the API expects
+sys.path.insert(0, '/code')
+from app.search import chunk_text, path_root  # noqa: E402
+from app.search_cache import bump_generation  # noqa: E402
 
 celery_app = Celery("vericase-docs", broker=settings.REDIS_URL, backend=settings.REDIS_URL)
+# Queues are served by separate worker pools (see docker-compose.yml), each tuned with
+# its own --concurrency and CELERY_PREFETCH_MULTIPLIER
+celery_app.conf.worker_prefetch_multiplier = settings.CELERY_PREFETCH_MULTIPLIER
+celery_app.conf.broker_transport_options = {"visibility_timeout": settings.CELERY_VISIBILITY_TIMEOUT}
+
+@worker_init.connect
+def _start_metrics_server(**_):
+    metrics.start_server()
+@worker_process_shutdown.connect
+def _pool_process_exited(pid=None, **_):
+    metrics.process_exited(pid or os.getpid())
 
 # Initialize S3 client based on AWS mode
 use_aws = settings.USE_AWS_SERVICES or not settings.MINIO_ENDPOINT
@@ -40,6 +64,22 @@ os_client = OpenSearch(
     verify_certs=settings.OPENSEARCH_VERIFY_CERTS,
     connection_class=RequestsHttpConnection
 )
+redis_client = redis.Redis.from_url(settings.REDIS_URL)
+INDEX_BUFFER_KEY = "vericase:index-buffer"
+INDEX_FLUSH_LOCK = "vericase:index-buffer:scheduled"
+INDEX_RETRY_KEY = "vericase:index-buffer:attempts"  # doc id -> failed bulk attempts
+REFRESH_LOCK = "vericase:index-refresh:scheduled"
+TIKA_SLOTS_KEY = "vericase:tika:slots"
+log = logging.getLogger(__name__)
+
+# Keep-alive connections to Tika; 503s (Tika overloaded or restarting) are retried with backoff.
+# urllib3 rewinds the streamed file body before each retry.
+tika_session = requests.Session()
+tika_session.mount(settings.TIKA_URL, HTTPAdapter(
+    pool_connections=1, pool_maxsize=max(settings.TIKA_MAX_CONCURRENCY, 1),
+    max_retries=Retry(total=settings.TIKA_RETRIES, connect=settings.TIKA_RETRIES, read=0, status_forcelist=[503],
+                      allowed_methods=frozenset(["PUT"]), backoff_factor=settings.TIKA_RETRY_BACKOFF,
+                      respect_retry_after_header=True, raise_on_status=False)))
 def _update_status(doc_id: str, status: str, excerpt: str|None=None):
     with engine.begin() as conn:
         if excerpt is not None:
@@ -52,56 +92,309 @@ def _fetch_doc(doc_id: str):
         row = conn.execute(text("SELECT id::text, filename, content_type, bucket, s3_key, path, created_at, metadata, owner_user_id FROM documents WHERE id::text=:i"),
                            {"i": doc_id}).mappings().first()
         return dict(row) if row else None
-def _index_document(doc_id: str, filename: str, created_at, content_type: str, metadata: dict, text: str, path: str|None, owner_user_id: str|None):
-    body = {"id": doc_id, "filename": filename, "title": None, "path": path, "owner": owner_user_id,
-            "content_type": content_type, "uploaded_at": created_at, "metadata": metadata or {}, "text": text}
-    os_client.index(index=settings.OPENSEARCH_INDEX, id=doc_id, body=body, refresh=True)
-def _tika_extract(file_bytes: bytes) -> str:
+def _index_document(doc_id: str, filename: str, created_at, content_type: str, metadata: dict, text: str, path: str|None, owner_user_id: str|None, sha256: str|None=None):
+    # Text goes in as nested chunks (see app.search.chunk_text) so search and highlighting stay cheap on huge documents
+    body = {"id": doc_id, "filename": filename, "title": None, "path": path, "path_root": path_root(path), "owner": owner_user_id,
+            "content_type": content_type, "uploaded_at": created_at, "metadata": metadata or {}, "chunks": chunk_text(text),
+            # content_sha256 lets the reindex job (app.reindex) rebuild from extraction_cache
+            "indexed_at": datetime.now(timezone.utc).isoformat(), "content_sha256": sha256}
+    if settings.INDEX_BUFFER_WINDOW > 0:
+        # Documents finishing within the window go out together in one _bulk call
+        redis_client.rpush(INDEX_BUFFER_KEY, json.dumps(body, default=_json_default))
+        _schedule_flush(settings.INDEX_BUFFER_WINDOW)
+        return
+    if settings.OPENSEARCH_REFRESH == "wait_for":
+        os_client.index(index=settings.OPENSEARCH_INDEX, id=doc_id, body=body, refresh="wait_for")
+    else:
+        os_client.index(index=settings.OPENSEARCH_INDEX, id=doc_id, body=body)
+        _schedule_refresh()
+    bump_generation(settings.OPENSEARCH_INDEX)
+def _json_default(o):
+    return o.isoformat() if hasattr(o, "isoformat") else str(o)
+def _schedule_refresh():
+    # "periodic": at most one refresh per OPENSEARCH_REFRESH_PERIOD, however many documents land
+    if settings.OPENSEARCH_REFRESH != "periodic": return
+    if redis_client.set(REFRESH_LOCK, 1, nx=True, ex=max(int(settings.OPENSEARCH_REFRESH_PERIOD), 1)):
+        refresh_index.apply_async(countdown=settings.OPENSEARCH_REFRESH_PERIOD)
+@celery_app.task(name="worker_app.worker.refresh_index", queue=settings.CELERY_FAST_QUEUE)
+def refresh_index():
+    os_client.indices.refresh(index=settings.OPENSEARCH_INDEX)
+def _schedule_flush(countdown: float):
+    if redis_client.set(INDEX_FLUSH_LOCK, 1, nx=True, ex=max(int(countdown)*10, 60)):
+        flush_index_buffer.apply_async(countdown=countdown)
+def _rebuffer(items: list):
+    # Back at the head, so a newer copy of the same document pushed meanwhile still wins in the next _bulk
+    redis_client.lpush(INDEX_BUFFER_KEY, *reversed(items))
+@celery_app.task(name="worker_app.worker.flush_index_buffer", queue=settings.CELERY_FAST_QUEUE)
+def flush_index_buffer():
+    """Send buffered documents to OpenSearch in a single _bulk request"""
+    redis_client.delete(INDEX_FLUSH_LOCK)
+    pipe=redis_client.pipeline()  # MULTI/EXEC, so concurrent pushes are never lost
+    pipe.lrange(INDEX_BUFFER_KEY, 0, settings.INDEX_BUFFER_MAX_DOCS-1)
+    pipe.ltrim(INDEX_BUFFER_KEY, settings.INDEX_BUFFER_MAX_DOCS, -1)
+    items, _ = pipe.execute()
+    if not items: return {"indexed": 0}
+    raw_by_id={json.loads(raw)["id"]: raw for raw in items}
+    actions=[{"_index": settings.OPENSEARCH_INDEX, "_id": b["id"], "_source": b} for b in map(json.loads, items)]
+    refresh="wait_for" if settings.OPENSEARCH_REFRESH=="wait_for" else False
     try:
-        r = requests.put(f"{settings.TIKA_URL}/tika", data=file_bytes, headers={"Accept":"text/plain"}, timeout=60)
-        if r.status_code==200 and r.text: return r.text
+        ok, errors = helpers.bulk(os_client, actions, refresh=refresh, raise_on_error=False, max_retries=3)
+    except Exception:
+        # Put the batch back and make sure something flushes it, rather than waiting for the next upload
+        log.warning("Bulk index of %d buffered documents failed, retrying in %ss", len(items), settings.INDEX_BUFFER_RETRY_DELAY, exc_info=True)
+        _rebuffer(items); _schedule_flush(settings.INDEX_BUFFER_RETRY_DELAY)
+        raise
+    # Throttled/unavailable items are retried a few times; anything else (e.g. mapping errors) won't succeed
+    retry=set(); failed=set()
+    for error in errors:
+        info=next(iter(error.values())); doc_id=info.get("_id"); status=info.get("status") or 0
+        log.warning("Bulk index of document %s failed (%s): %s", doc_id, status, info.get("error"))
+        # A write block means the index is being swapped for a new version (app.reindex) - the retry lands there
+        retryable=status==429 or status>=500 or (info.get("error") or {}).get("type")=="cluster_block_exception"
+        if retryable and redis_client.hincrby(INDEX_RETRY_KEY, doc_id, 1) < settings.INDEX_BUFFER_MAX_ATTEMPTS:
+            retry.add(doc_id)
+        else:
+            failed.add(doc_id)
+    settled=[doc_id for doc_id in raw_by_id if doc_id not in retry]
+    if settled: redis_client.hdel(INDEX_RETRY_KEY, *settled)
+    for doc_id in failed:
+        log.error("Giving up indexing document %s", doc_id); _update_status(doc_id, "FAILED")
+    if retry: _rebuffer([raw_by_id[doc_id] for doc_id in retry])
+    _schedule_refresh(); bump_generation(settings.OPENSEARCH_INDEX)
+    # Retries, more than one batch holds, or documents that arrived while we were flushing
+    if redis_client.llen(INDEX_BUFFER_KEY):
+        _schedule_flush(settings.INDEX_BUFFER_RETRY_DELAY if retry else
+                        0 if len(items)>=settings.INDEX_BUFFER_MAX_DOCS else settings.INDEX_BUFFER_WINDOW)
+    return {"indexed": ok, "retried": len(retry), "failed": len(failed)}
+def _cache_get(sha256: str) -> str|None:
+    try:
+        with engine.begin() as conn:
+            return conn.execute(text("SELECT text FROM extraction_cache WHERE sha256=:h"), {"h": sha256}).scalar()
+    except Exception: return None
+def _cache_put(sha256: str, extracted: str, method: str):
+    # Postgres TEXT can't hold NUL bytes, which Tika occasionally emits
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO extraction_cache (sha256, text, method) VALUES (:h, :t, :m) ON CONFLICT (sha256) DO NOTHING"),
+                         {"h": sha256, "t": extracted.replace("\x00", ""), "m": method})
     except Exception: pass
+def _spool_object(bucket: str, key: str, suffix: str="") -> tuple:
+    """Stream an S3 object to a local spool file, hashing as it goes; returns (path, sha256, size)"""
+    body=s3.get_object(Bucket=bucket, Key=key)["Body"]
+    digest=hashlib.sha256(); size=0
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=settings.WORKER_SCRATCH_DIR or None)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in body.iter_chunks(chunk_size=1024*1024):
+                f.write(chunk); digest.update(chunk); size+=len(chunk)
+    except Exception:
+        os.remove(path); raise
+    return path, digest.hexdigest(), size
+class TikaBusy(Exception):
+    """No Tika slot freed up within TIKA_ACQUIRE_TIMEOUT"""
+def _tika_acquire() -> str|None:
+    """
+    Take one of TIKA_MAX_CONCURRENCY cluster-wide Tika slots (a Redis sorted-set semaphore)
+
+    Slots expire once every retry would have timed out, so a killed worker can't leak one. Returns
+    the slot token, or None if limiting is off or Redis is down. Raises TikaBusy if no slot frees
+    up within TIKA_ACQUIRE_TIMEOUT - the task is retried later rather than piling onto Tika.
+    """
+    if settings.TIKA_MAX_CONCURRENCY <= 0: return None
+    token=uuid.uuid4().hex; deadline=time.monotonic()+settings.TIKA_ACQUIRE_TIMEOUT
+    try:
+        while True:
+            now=time.time(); pipe=redis_client.pipeline()
+            pipe.zremrangebyscore(TIKA_SLOTS_KEY, "-inf", now-settings.TIKA_TIMEOUT*(settings.TIKA_RETRIES+1))
+            pipe.zadd(TIKA_SLOTS_KEY, {token: now}); pipe.zrank(TIKA_SLOTS_KEY, token)
+            rank=pipe.execute()[2]
+            if rank is not None and rank < settings.TIKA_MAX_CONCURRENCY: return token
+            redis_client.zrem(TIKA_SLOTS_KEY, token)
+            if time.monotonic()>=deadline:
+                raise TikaBusy(f"No Tika slot free after {settings.TIKA_ACQUIRE_TIMEOUT}s")
+            time.sleep(0.2)
+    except redis.RedisError:
+        return None
+def _tika_release(token: str|None):
+    if token:
+        try: redis_client.zrem(TIKA_SLOTS_KEY, token)
+        except redis.RedisError: pass
+def _tika_extract(path: str) -> str:
+    started=time.monotonic(); token=_tika_acquire(); waited=time.monotonic()-started; status=None
+    try:
+        # requests streams file objects, so the body is never held in memory
+        with open(path, "rb") as f, metrics.stage("tika"):
+            r = tika_session.put(f"{settings.TIKA_URL}/tika", data=f, headers={"Accept":"text/plain"}, timeout=(10, settings.TIKA_TIMEOUT))
+        status=r.status_code
+        if r.status_code==200 and r.text: return r.text
+    except Exception as e:
+        status=type(e).__name__
+    finally:
+        _tika_release(token)
+        log.info("Tika extraction of %s (%d bytes): %s in %.0f ms, %.0f ms waiting for a slot", os.path.basename(path),
+                 os.path.getsize(path), status, (time.monotonic()-started-waited)*1000, waited*1000)
     return ""
-def _ocr_pdf_sidecar(in_path: str) -> str:
+def _pdf_page_count(path: str) -> int:
+    try:
+        r = subprocess.run(["qpdf","--show-npages", path], check=True, capture_output=True, text=True)
+        return int(r.stdout.strip())
+    except (subprocess.CalledProcessError, ValueError, OSError): return 0
+def _ocrmypdf_sidecar(in_path: str, jobs: int) -> str:
     sidecar = in_path + ".txt"
     try:
-        subprocess.run(["ocrmypdf","--sidecar", sidecar,"--force-ocr", in_path, in_path + ".ocr.pdf"], check=True, capture_output=True)
+        # Only the text is used, so skip rendering an output PDF
+        subprocess.run(["ocrmypdf","--jobs", str(max(1, jobs)),"--sidecar", sidecar,"--output-type","none","--force-ocr", in_path, "-"],
+                       check=True, capture_output=True)
         with open(sidecar,"r",encoding="utf-8",errors="ignore") as f: return f.read()
     except subprocess.CalledProcessError: return ""
     finally:
         try: os.remove(sidecar)
         except Exception: pass
-def _ocr_image_bytes(file_bytes: bytes) -> str:
+def _page_spec(pages: list) -> str:
+    """qpdf page list for ascending page numbers, e.g. [1,2,3,7] -> 1-3,7"""
+    ranges=[]
+    for p in pages:
+        if ranges and ranges[-1][1]==p-1: ranges[-1][1]=p
+        else: ranges.append([p, p])
+    return ",".join(f"{a}-{b}" if a!=b else str(a) for a, b in ranges)
+def _ocr_pdf_shard(in_path: str, pages: list, jobs: int) -> str:
+    shard = f"{in_path}.{pages[0]}-{pages[-1]}.pdf"
+    try:
+        subprocess.run(["qpdf","--warning-exit-0","--empty","--pages", in_path, _page_spec(pages),"--", shard], check=True, capture_output=True)
+        return _ocrmypdf_sidecar(shard, jobs)
+    except subprocess.CalledProcessError: return ""
+    finally:
+        try: os.remove(shard)
+        except Exception: pass
+def _ocr_pdf_pages(in_path: str, pages: list, total: int) -> dict:
+    """OCR the given 1-based pages in shards of OCR_PAGES_PER_SHARD run side by side; returns {page: text}"""
+    per_shard = max(1, settings.OCR_PAGES_PER_SHARD)
+    shards = [pages[i:i + per_shard] for i in range(0, len(pages), per_shard)]
+    metrics.add_ocr_pages(len(pages))
+    with metrics.stage("ocr"):
+        if len(pages) == total and len(shards) == 1:
+            texts = [_ocrmypdf_sidecar(in_path, settings.OCR_PARALLELISM)]
+        elif len(shards) == 1 or settings.OCR_PARALLELISM <= 1:
+            texts = [_ocr_pdf_shard(in_path, shard, settings.OCR_PARALLELISM) for shard in shards]
+        else:
+            # ocrmypdf runs as a subprocess, so threads are enough to keep every core busy
+            with ThreadPoolExecutor(max_workers=settings.OCR_PARALLELISM) as pool:
+                texts = list(pool.map(lambda shard: _ocr_pdf_shard(in_path, shard, 1), shards))
+    result = {}
+    for shard, t in zip(shards, texts):
+        # Sidecar pages are separated by form feeds
+        parts = t[:-1].split("\f") if t.endswith("\f") else t.split("\f")
+        if len(parts) != len(shard): parts = [t] + [""] * (len(shard) - 1)
+        result.update(zip(shard, parts))
+    return result
+def _ocr_pdf_sidecar(in_path: str) -> str:
+    """OCR every page of a PDF; long PDFs are sharded and stitched back in page order"""
+    total = _pdf_page_count(in_path)
+    if total <= 0:
+        with metrics.stage("ocr"): return _ocrmypdf_sidecar(in_path, settings.OCR_PARALLELISM)
+    ocr = _ocr_pdf_pages(in_path, list(range(1, total + 1)), total)
+    return "\f".join(ocr[p] for p in range(1, total + 1))
+def _extract_pdf(path: str) -> tuple:
+    """
+    Per-page text-layer detection: pages with a text layer are used as-is and only
+    image-only pages (less than NATIVE_PDF_MIN_PAGE_CHARS) are OCR'd, like ocrmypdf
+    --skip-text. Returns (text, method).
+    """
+    with metrics.stage("text_layer"): pages=extractors.pdf_page_texts(path)
+    if not pages:
+        # No readable text layer - Tika may still cope, otherwise OCR everything
+        text=_tika_extract(path)
+        if text and len(text.strip())>=50: return text, "tika"
+        return _ocr_pdf_sidecar(path) or "", "ocr"
+    sparse=[i+1 for i, p in enumerate(pages) if len(p.strip())<settings.NATIVE_PDF_MIN_PAGE_CHARS]
+    if not sparse: return "\f".join(pages), "native"
+    for page, t in _ocr_pdf_pages(path, sparse, len(pages)).items():
+        # A genuinely short page keeps its text layer if OCR found no more
+        if len(t.strip())>len(pages[page-1].strip()): pages[page-1]=t
+    return "\f".join(pages), "ocr" if len(sparse)==len(pages) else "native+ocr"
+def _ocr_image_file(path: str) -> str:
     try:
-        from PIL import Image
-        with Image.open(io.BytesIO(file_bytes)) as im: return pytesseract.image_to_string(im)
+        with metrics.stage("ocr"), Image.open(path) as im:
+            metrics.add_ocr_pages(1)
+            return pytesseract.image_to_string(im)
     except Exception: return ""
-@celery_app.task(name="worker_app.worker.ocr_and_index", queue=settings.CELERY_QUEUE)
-def ocr_and_index(doc_id: str):
+@celery_app.task(bind=True, name="worker_app.worker.ocr_and_index", queue=settings.CELERY_QUEUE)
+def ocr_and_index(self, doc_id: str):
+    try:
+        return _ocr_and_index(doc_id)
+    except TikaBusy as e:
+        if self.request.retries >= settings.TIKA_BUSY_MAX_RETRIES:
+            _update_status(doc_id, "FAILED", "Text extraction is overloaded - please re-upload later"); raise
+        # Jittered, so a backlog of waiting documents doesn't come back all at once
+        log.warning("%s; retrying document %s", e, doc_id)
+        raise self.retry(exc=e, countdown=settings.TIKA_BUSY_RETRY_DELAY*random.uniform(1, 2), max_retries=settings.TIKA_BUSY_MAX_RETRIES)
+def _ocr_and_index(doc_id: str):
     doc=_fetch_doc(doc_id)
     if not doc:
         return
-    _update_status(doc_id,"PROCESSING",None)
-    obj=s3.get_object(Bucket=doc["bucket"], Key=doc["s3_key"]); fb=obj["Body"].read()
-    text=_tika_extract(fb)
-    if not text or len(text.strip())<50:
+    with metrics.task() as m:
+        with metrics.stage("db_update"): _update_status(doc_id,"PROCESSING",None)
         name=(doc["filename"] or "").lower()
-        if name.endswith(".pdf"):
-            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-                tmp.write(fb); tmp.flush()
-                text=_ocr_pdf_sidecar(tmp.name) or ""
-                try: os.remove(tmp.name + ".ocr.pdf")
-                except Exception: pass
-                os.remove(tmp.name)
-        else:
-            text=_ocr_image_bytes(fb) or ""
-    excerpt=(text.strip()[:1000]) if text else ""
-    _index_document(doc_id, doc["filename"], doc["created_at"], doc.get("content_type") or "application/octet-stream", doc.get("metadata"), text or "", doc.get("path"), doc.get("owner_user_id"))
-    _update_status(doc_id,"READY",excerpt)
-    return {"id": doc_id, "chars": len(text or "")}
+        # Spool to disk so memory stays flat whatever the document size; Tika and OCR share the file
+        with metrics.stage("s3_fetch"):
+            path, sha256, size = _spool_object(doc["bucket"], doc["s3_key"], os.path.splitext(name)[1])
+        metrics.add_bytes(size)
+        try:
+            # Identical bytes (re-uploads, the same PDF attached to many emails) are extracted once
+            with metrics.stage("cache"): text=_cache_get(sha256)
+            metrics.cache_result(text is not None); method="cache"
+            if text is None:
+                # Common formats are read in-process; Tika (then OCR) only handles the rest
+                if name.endswith(".pdf") or doc.get("content_type")=="application/pdf":
+                    text, method = _extract_pdf(path)
+                else:
+                    with metrics.stage("native"): text=extractors.extract(path, name, doc.get("content_type"))
+                    method="native"
+                if not text.strip() and method=="native":
+                    text=_tika_extract(path); method="tika"
+                    if not text or len(text.strip())<50:
+                        method="ocr"; text=_ocr_image_file(path) or ""
+                # Empty output may just mean Tika was unavailable - don't pin it
+                if text and text.strip(): _cache_put(sha256, text, method)
+            metrics.document_extracted(method)
+        finally:
+            try: os.remove(path)
+            except Exception: pass
+        excerpt=(text.strip()[:1000]) if text else ""
+        with metrics.stage("index"):
+            _index_document(doc_id, doc["filename"], doc["created_at"], doc.get("content_type") or "application/octet-stream", doc.get("metadata"), text or "", doc.get("path"), doc.get("owner_user_id"), sha256)
+        with metrics.stage("db_update"): _update_status(doc_id,"READY",excerpt)
+    return {"id": doc_id, "chars": len(text or ""), "method": method, "metrics": m.summary()}
+
+
+def _pst_processor():
+    """Create a PST processor bound to a fresh DB session (caller closes processor.db)"""
+    import sys
+    from sqlalchemy.orm import sessionmaker
+    
+    # Import PST processor (import here to avoid loading pypff in main process)
+    sys.path.insert(0, '/code')
+    from app.pst_processor import UltimatePSTProcessor
+    
+    SessionLocal = sessionmaker(bind=engine)
+    return UltimatePSTProcessor(db=SessionLocal(), s3_client=s3, opensearch_client=os_client)
 
 
-@celery_app.task(name="worker_app.worker.process_pst_file", queue=settings.CELERY_QUEUE)
+@celery_app.task(name="worker_app.worker.reindex_documents", queue=settings.CELERY_QUEUE)
+def reindex_documents(slices: int|None=None):
+    """Rebuild the documents index into a new version and swap the alias (see app.reindex)"""
+    import sys
+    sys.path.insert(0, '/code')
+    from app.reindex import reindex
+    return reindex(slices)
+
+
+# PST tasks are acked only once they finish, so one killed mid-run (OOM, pod eviction) is
+# redelivered and resumes from its checkpoint; re-running is safe as Evidence ids are deterministic
+PST_TASK_OPTIONS = {"acks_late": True, "reject_on_worker_lost": True}
+
+
+@celery_app.task(name="worker_app.worker.process_pst_file", queue=settings.CELERY_PST_QUEUE, **PST_TASK_OPTIONS)
 def process_pst_file(doc_id: str, case_id: str, company_id: str):
     """
     THE ULTIMATE PST PROCESSOR TASK
@@ -111,10 +404,12 @@ def process_pst_file(doc_id: str, case_id: str, company_id: str):
     - Extracts all attachments with deduplication
     - Builds email threads (Message-ID, In-Reply-To, Conversation-Index)
     - Indexes to OpenSearch for instant search
+    
+    With PST_PARALLEL_PARTITIONS > 1 the PST is split into partitions that
+    run as process_pst_partition subtasks, followed by finalize_pst.
     """
-    import sys
     import logging
-    from sqlalchemy.orm import Session, sessionmaker
+    from celery import chord
     
     # Setup logging
     logging.basicConfig(level=logging.INFO)
@@ -123,14 +418,7 @@ def process_pst_file(doc_id: str, case_id: str, company_id: str):
     logger.info(f"Starting PST processing for document {doc_id}")
     
     try:
-        # Import PST processor (import here to avoid loading pypff in main process)
-        sys.path.insert(0, '/code')
-        from app.pst_processor import UltimatePSTProcessor
-        from app.models import Document
-        
-        # Create DB session
-        SessionLocal = sessionmaker(bind=engine)
-        db = SessionLocal()
+        processor = _pst_processor()
         
         try:
             # Get document info
@@ -142,12 +430,19 @@ def process_pst_file(doc_id: str, case_id: str, company_id: str):
             # Update status
             _update_status(doc_id, "PROCESSING", "Extracting PST file...")
             
-            # Initialize processor
-            processor = UltimatePSTProcessor(
-                db=db,
-                s3_client=s3,
-                opensearch_client=os_client
-            )
+            if settings.PST_PARALLEL_PARTITIONS > 1:
+                plan = processor.plan_partitions(
+                    pst_s3_key=doc["s3_key"],
+                    document_id=doc_id,
+                    partitions=settings.PST_PARALLEL_PARTITIONS,
+                    min_messages=settings.PST_PARTITION_MIN_MESSAGES
+                )
+                chord(
+                    process_pst_partition.s(doc_id, case_id, company_id, segments)
+                    for segments in plan
+                )(finalize_pst.s(doc_id, case_id))
+                logger.info(f"PST {doc_id} split into {len(plan)} partitions")
+                return {"partitions": len(plan)}
             
             # Process PST
             stats = processor.process_pst(
@@ -166,9 +461,39 @@ def process_pst_file(doc_id: str, case_id: str, company_id: str):
             return stats
             
         finally:
-            db.close()
+            processor.db.close()
             
     except Exception as e:
         logger.error(f"PST processing failed: {e}", exc_info=True)
         _update_status(doc_id, "FAILED", f"PST processing error: {str(e)}")
         raise
+
+
+@celery_app.task(name="worker_app.worker.process_pst_partition", queue=settings.CELERY_PST_QUEUE, **PST_TASK_OPTIONS)
+def process_pst_partition(doc_id: str, case_id: str, company_id: str, segments: list):
+    """Extract one partition of a PST - see UltimatePSTProcessor.plan_partitions"""
+    doc = _fetch_doc(doc_id)
+    if not doc:
+        return {"errors": [f"Document {doc_id} not found"], "failed": True}
+    processor = _pst_processor()
+    try:
+        return processor.process_partition(doc["s3_key"], doc_id, case_id, company_id, segments)
+    finally:
+        processor.db.close()
+
+
+@celery_app.task(name="worker_app.worker.finalize_pst", queue=settings.CELERY_PST_QUEUE, **PST_TASK_OPTIONS)
+def finalize_pst(partial_stats: list, doc_id: str, case_id: str):
+    """Reduce step for partitioned PSTs: merge stats and build threads"""
+    processor = _pst_processor()
+    try:
+        stats = processor.finalize_partitions(doc_id, case_id, partial_stats)
+    except Exception as e:
+        _update_status(doc_id, "FAILED", f"PST processing error: {str(e)}")
+        raise
+    finally:
+        processor.db.close()
+    status = "FAILED" if any(p.get("failed") for p in partial_stats) else "READY"
+    excerpt = f"PST processed: {stats['total_emails']} emails, {stats['total_attachments']} attachments, {stats['threads_identified']} threads"
+    _update_status(doc_id, status, excerpt)
+    return stats